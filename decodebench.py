@@ -0,0 +1,129 @@
+"""
+Compares per-sample cost of decoding port values: if/elif chains as peripherals had them
+against the per-mode ValueDecoder tables they have now.
+Runs on the board and with CPython.
+"""
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+from ustruct import unpack_from
+
+from pylgbst.peripherals import EncodedMotor, LEDRGB, TiltSensor, VisionSensor, Voltage, Current, RatioDecoder
+from pylgbst.utilities import usbyte, ushort, usint
+
+COUNT = 2000
+
+
+def motor_chain(mode, data):
+    if mode == EncodedMotor.SENSOR_ANGLE:
+        angle = unpack_from("<l", data, 0)[0]
+        return (angle,)
+    elif mode == EncodedMotor.SENSOR_SPEED:
+        speed = unpack_from("<b", data, 0)[0]
+        return (speed,)
+    return ()
+
+
+def led_chain(mode, data):
+    if mode == LEDRGB.MODE_RGB:
+        return usbyte(data, 0), usbyte(data, 1), usbyte(data, 2),
+    return usbyte(data, 0),
+
+
+def tilt_chain(mode, data):
+    if mode == TiltSensor.MODE_2AXIS_ANGLE:
+        roll = unpack_from('<b', data, 0)[0]
+        pitch = unpack_from('<b', data, 1)[0]
+        return (roll, pitch)
+    elif mode == TiltSensor.MODE_3AXIS_SIMPLE:
+        return (usbyte(data, 0),)
+    elif mode == TiltSensor.MODE_2AXIS_SIMPLE:
+        return (usbyte(data, 0),)
+    elif mode == TiltSensor.MODE_IMPACT_COUNT:
+        return (usint(data, 0),)
+    elif mode == TiltSensor.MODE_3AXIS_ACCEL:
+        roll = unpack_from('<b', data, 0)[0]
+        pitch = unpack_from('<b', data, 1)[0]
+        yaw = unpack_from('<b', data, 2)[0]
+        return (roll, pitch, yaw)
+    elif mode == TiltSensor.MODE_ORIENT_CF:
+        return (usbyte(data, 0),)
+    elif mode == TiltSensor.MODE_IMPACT_CF:
+        return (usbyte(data, 0),)
+    elif mode == TiltSensor.MODE_CALIBRATION:
+        return (usbyte(data, 0), usbyte(data, 1), usbyte(data, 2))
+    return ()
+
+
+def vision_chain(mode, data):
+    if mode == VisionSensor.COLOR_INDEX:
+        return (usbyte(data, 0),)
+    elif mode == VisionSensor.COLOR_DISTANCE_FLOAT:
+        color = usbyte(data, 0)
+        val = usbyte(data, 1)
+        partial = usbyte(data, 3)
+        if partial:
+            val += 1.0 / partial
+        return (color, float(val))
+    elif mode == VisionSensor.DISTANCE_INCHES:
+        return (usbyte(data, 0),)
+    elif mode == VisionSensor.DISTANCE_REFLECTED:
+        return (usbyte(data, 0) / 100.0,)
+    elif mode == VisionSensor.AMBIENT_LIGHT:
+        return (usbyte(data, 0) / 100.0,)
+    elif mode == VisionSensor.COUNT_2INCH:
+        return (usint(data, 0),)
+    elif mode == VisionSensor.COLOR_RGB:
+        val1 = int(255 * ushort(data, 0) / 1023.0)
+        val2 = int(255 * ushort(data, 2) / 1023.0)
+        val3 = int(255 * ushort(data, 4) / 1023.0)
+        return (val1, val2, val3)
+    elif mode == VisionSensor.DEBUG:
+        return (10 * ushort(data, 0) / 1023.0, 10 * ushort(data, 2) / 1023.0)
+    elif mode == VisionSensor.CALIBRATE:
+        return [ushort(data, x * 2) for x in range(8)]
+    return ()
+
+
+def voltage_chain(mode, data):
+    return (9600.0 * ushort(data, 0) / 3893.0 / 1000.0,)
+
+
+def current_chain(mode, data):
+    return (2444 * ushort(data, 0) / 4095.0,)
+
+
+def per_sample(func, mode, data):
+    started = ticks_us()
+    for _ in range(COUNT):
+        func(mode, data)
+    return ticks_diff(ticks_us(), started) / COUNT
+
+
+def main():
+    data = memoryview(bytes([0xfe, 0x07, 0xff, 0x03, 0x10, 0x02, 0, 0, 1, 0, 2, 0, 3, 0, 4, 0]))
+
+    print("%-14s %4s %10s %10s" % ("peripheral", "mode", "chain us", "table us"))
+    for cls, chain in ((EncodedMotor, motor_chain), (LEDRGB, led_chain), (TiltSensor, tilt_chain),
+                       (VisionSensor, vision_chain), (Voltage, voltage_chain), (Current, current_chain)):
+        for mode, decoder in enumerate(cls.DECODERS):
+            if decoder is None:
+                continue
+            exact = isinstance(decoder, RatioDecoder)  # divides as the chain does
+            for old, new in zip(chain(mode, data), decoder.decode(data)):
+                assert old == new if exact else abs(old - new) < 1e-6, \
+                    "%s mode %s decodes differently" % (cls.__name__, mode)
+            table = per_sample(lambda _, values: decoder.decode(values), mode, data)
+            print("%-14s %4s %10.2f %10.2f" % (cls.__name__, mode, per_sample(chain, mode, data), table))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Reports heap taken by messages and peripherals kept per port, in their compact form (__slots__)
+and dict-backed as they were before, plus constant tables as dicts and as tuples.
+Runs on the board (gc.mem_alloc) and with CPython (tracemalloc).
+"""
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pylgbst.messages import MsgPortInputFmtSingle, MsgPortOutput, MsgPortOutputFeedback, MsgPortValueSingle, \
+    MsgPortModeInfo, MsgPortModeInfoRequest, MsgGenericError
+from pylgbst.peripherals import EncodedMotor, LEDRGB, TiltSensor, VisionSensor, Voltage, Current
+
+COUNT = 50
+
+# what a Move Hub with a vision sensor keeps alive
+HUB_PERIPHERALS = (EncodedMotor, EncodedMotor, EncodedMotor, LEDRGB, TiltSensor, VisionSensor, Voltage, Current)
+
+
+def heap_used():
+    gc.collect()
+    if tracemalloc:
+        return tracemalloc.get_traced_memory()[0]
+    return gc.mem_alloc()
+
+
+def measure(factory, count=COUNT):
+    """
+    :return: bytes of heap per object made by factory
+    """
+    factory()  # anything made once per class is not counted
+    objs = [None] * count
+    before = heap_used()
+    for i in range(count):
+        objs[i] = factory()
+    used = heap_used() - before
+    del objs
+    return used // count
+
+
+_loose_classes = {}
+
+
+def loose(cls):
+    """
+    Subclass with instance dict, the way classes were before getting __slots__
+    """
+    if cls not in _loose_classes:
+        class Loose(cls):
+            pass
+
+        _loose_classes[cls] = Loose
+    return _loose_classes[cls]
+
+
+def report(name, factory, loose_factory):
+    dicted = measure(loose_factory)
+    compact = measure(factory)
+    print("%-24s %6s %6s" % (name, dicted, compact))
+    return dicted, compact
+
+
+def main():
+    if tracemalloc:
+        tracemalloc.start()
+
+    frame = memoryview(bytes([0x08, 0x00, 0x45, 0x00, 0x10, 0x00, 0x00, 0x00]))
+
+    def received(cls, **fields):
+        # as decode() leaves it, without depending on how the runtime binds decode to a class
+        msg = cls()
+        msg.payload = frame
+        for name, val in fields.items():
+            setattr(msg, name, val)
+        return msg
+
+    for cls in (MsgPortValueSingle, MsgPortOutputFeedback, MsgPortOutput, MsgPortInputFmtSingle):
+        loose(cls)
+
+    print("%-24s %6s %6s" % ("bytes per object", "dict", "slots"))
+    report("MsgPortValueSingle",
+           lambda: received(MsgPortValueSingle, port=0),
+           lambda: received(loose(MsgPortValueSingle), port=0))
+    report("MsgPortOutputFeedback",
+           lambda: received(MsgPortOutputFeedback, port=0, status=0x0a, feedback=((0, 0x0a),)),
+           lambda: received(loose(MsgPortOutputFeedback), port=0, status=0x0a, feedback=((0, 0x0a),)))
+    report("MsgPortOutput",
+           lambda: MsgPortOutput(0, 0x09, (1000, 50, 100, 0, 3)),
+           lambda: loose(MsgPortOutput)(0, 0x09, (1000, 50, 100, 0, 3)))
+    report("MsgPortInputFmtSingle",
+           lambda: MsgPortInputFmtSingle(0, None, False, 1),
+           lambda: loose(MsgPortInputFmtSingle)(0, None, False, 1))
+
+    measure(lambda: Current(None, 0))  # warms up what peripherals allocate on first use only
+    total_dicted = total_compact = 0
+    sizes = {}
+    for cls in HUB_PERIPHERALS:
+        if cls not in sizes:
+            loose(cls)  # not to count the class itself
+            sizes[cls] = report(cls.__name__, lambda: cls(None, 0), lambda: loose(cls)(None, 0))
+        total_dicted += sizes[cls][0]
+        total_compact += sizes[cls][1]
+    print("%-24s %6s %6s" % ("peripherals total", total_dicted, total_compact))
+
+    print("")
+    print("%-24s %6s %6s" % ("bytes per table", "dict", "tuple"))
+    for name, table in (("MAPPING_FLAGS", MsgPortModeInfo.MAPPING_FLAGS),
+                        ("DATASET_TYPES", MsgPortModeInfo.DATASET_TYPES),
+                        ("INFO_TYPES", MsgPortModeInfoRequest.INFO_TYPES),
+                        ("MsgGenericError.DESCR", MsgGenericError.DESCR)):
+        if isinstance(table[0], tuple):
+            as_dict = lambda: dict(table)
+        else:
+            as_dict = lambda: dict(enumerate(table))
+        # a tuple frozen into firmware takes no heap at all, built at runtime it costs this much
+        print("%-24s %6s %6s" % (name, measure(as_dict, 1), measure(lambda: tuple(list(table)), 1)))
+
+
+if __name__ == '__main__':
+    main()
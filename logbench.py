@@ -0,0 +1,72 @@
+"""
+Measures what a debug log call costs per notification while logging is at INFO level,
+the way Hub._notify used to log (arguments evaluated up front) against guarded calls.
+Runs on the board and with CPython, next to the bundled logging.py.
+"""
+import gc
+import logging
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+from pylgbst.utilities import str2hex
+
+COUNT = 2000
+
+log = logging.getLogger('bench')
+
+
+def eager(handle, data):
+    log.debug("Notification on %s: %s", handle, str2hex(data))
+
+
+def guarded(handle, data):
+    if __debug__ and log.isEnabledFor(logging.DEBUG):
+        log.debug("Notification on %s: %s", handle, str2hex(data))
+
+
+def nothing(handle, data):
+    pass
+
+
+def heap_used():
+    if hasattr(gc, 'mem_alloc'):
+        return gc.mem_alloc()
+    return None
+
+
+def measure(func, data):
+    gc.collect()
+    gc.disable()  # allocations pile up instead of being collected on the way
+    before = heap_used()
+    started = ticks_us()
+    for _ in range(COUNT):
+        func(0x0e, data)
+    spent = ticks_diff(ticks_us(), started)
+    after = heap_used()
+    gc.enable()
+    allocated = (after - before) // COUNT if before is not None else "n/a"
+    return spent / COUNT, allocated
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    data = bytes([0x05, 0x00, 0x45, 0x00, 0x10])  # port value notification
+
+    print("%-10s %10s %10s" % ("call", "us", "bytes"))
+    base = measure(nothing, data)[0]
+    for func in (eager, guarded):
+        spent, allocated = measure(func, data)
+        print("%-10s %10.2f %10s" % (func.__name__, spent - base, allocated))
+
+
+if __name__ == '__main__':
+    main()
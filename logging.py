@@ -1,5 +1,18 @@
 import sys
 
+try:
+    from ustruct import pack_into, unpack_from
+except ImportError:
+    from struct import pack_into, unpack_from
+
+try:
+    from time import ticks_ms
+except ImportError:
+    from time import time
+
+    def ticks_ms():
+        return int(time() * 1000) & 0x3fffffff
+
 CRITICAL = 50
 ERROR    = 40
 WARNING  = 30
@@ -22,8 +35,16 @@ class LogRecord:
         self.__dict__ = {}
 
     def __getattr__(self, key):
+        if key == "message":
+            return self.getMessage()  # formatted only if some handler asks for it
         return self.__dict__[key]
 
+    def getMessage(self):
+        d = self.__dict__
+        if d["args"]:
+            return d["msg"] % d["args"]
+        return d["msg"]
+
 class Handler:
     def __init__(self):
         pass
@@ -31,14 +52,140 @@ class Handler:
     def setFormatter(self, fmtr):
         pass
 
+class RingHandler(Handler):
+    """
+    Keeps last records in a preallocated buffer, as binary: ticks, level, logger id, format id and raw args.
+    Nothing is formatted nor written out when logging, so it is safe for IRQ handlers and costs no I/O;
+    records are turned into text only by records() and dump(). Oldest records are overwritten when full.
+
+    Args are kept as numbers, strings are kept as ids of a table shared with formats and logger names,
+    other objects as their type name. Up to MAX_ARGS args are kept per record.
+    """
+    MAX_ARGS = 4
+    HEADER = "<IBHHB"  # ticks, level, logger id, format id, arg count
+    HEADER_SIZE = 10
+    ARG_SIZE = 5  # type, 4 bytes of value
+    RECORD_SIZE = HEADER_SIZE + MAX_ARGS * ARG_SIZE
+    UNKNOWN = 0xFFFF  # id of a string that did not fit the table
+
+    ARG_INT = 1
+    ARG_FLOAT = 2
+    ARG_STR = 3
+    ARG_TYPE = 4
+
+    def __init__(self, capacity=128, max_strings=128):
+        """
+        :param capacity: records kept
+        :param max_strings: distinct formats, logger names and string args remembered
+        """
+        self.capacity = capacity
+        self.max_strings = max_strings
+        self.buf = bytearray(capacity * self.RECORD_SIZE)
+        self.count = 0
+        self.dropped = 0  # records overwritten before being dumped
+        self._next = 0
+        self._ids = {}
+        self._strings = []
+
+    def _intern(self, text):
+        sid = self._ids.get(text)
+        if sid is None:
+            if len(self._strings) >= self.max_strings:
+                return self.UNKNOWN
+            sid = len(self._strings)
+            self._ids[text] = sid
+            self._strings.append(text)
+        return sid
+
+    def emit(self, record):
+        d = record.__dict__
+        self.add(d["levelno"], d["name"], d["msg"], d["args"])
+
+    def add(self, level, name, msg, args):
+        buf = self.buf
+        off = self._next * self.RECORD_SIZE
+        count = min(len(args), self.MAX_ARGS)
+        pack_into(self.HEADER, buf, off, ticks_ms() & 0xffffffff, level,
+                  self._intern(name), self._intern(msg), count)
+        off += self.HEADER_SIZE
+        for i in range(count):
+            arg = args[i]
+            if isinstance(arg, int) and -0x80000000 <= arg <= 0x7fffffff:
+                pack_into("<Bi", buf, off, self.ARG_INT, arg)
+            elif isinstance(arg, (int, float)):
+                pack_into("<Bf", buf, off, self.ARG_FLOAT, arg)
+            elif isinstance(arg, str):
+                pack_into("<BI", buf, off, self.ARG_STR, self._intern(arg))
+            else:
+                pack_into("<BI", buf, off, self.ARG_TYPE, self._intern(type(arg).__name__))
+            off += self.ARG_SIZE
+
+        self._next = (self._next + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.dropped += 1
+
+    def _string(self, sid):
+        if sid < len(self._strings):
+            return self._strings[sid]
+        return "?"
+
+    def _decode(self, index):
+        off = index * self.RECORD_SIZE
+        ticks, level, name_id, msg_id, count = unpack_from(self.HEADER, self.buf, off)
+        off += self.HEADER_SIZE
+        args = []
+        for _ in range(count):
+            kind = self.buf[off]
+            if kind == self.ARG_INT:
+                args.append(unpack_from("<i", self.buf, off + 1)[0])
+            elif kind == self.ARG_FLOAT:
+                args.append(unpack_from("<f", self.buf, off + 1)[0])
+            elif kind == self.ARG_STR:
+                args.append(self._string(unpack_from("<I", self.buf, off + 1)[0]))
+            else:
+                args.append("<%s>" % self._string(unpack_from("<I", self.buf, off + 1)[0]))
+            off += self.ARG_SIZE
+
+        msg = self._string(msg_id)
+        try:
+            message = msg % tuple(args) if args else msg
+        except (TypeError, ValueError):  # args beyond MAX_ARGS, or not kept as numbers
+            message = "%s %s" % (msg, args)
+        return ticks, level, self._string(name_id), message
+
+    def records(self):
+        """
+        Yields (ticks, level, logger name, message) from oldest to newest, decoded one at a time
+        """
+        first = (self._next - self.count) % self.capacity
+        for i in range(self.count):
+            yield self._decode((first + i) % self.capacity)
+
+    def dump(self, stream=None, clear=True):
+        stream = stream or _stream
+        if self.dropped:
+            print("(%s older records dropped)" % self.dropped, file=stream)
+        for ticks, level, name, message in self.records():
+            print(ticks, " ", _level_dict.get(level, level), ":", name, ":", message, sep="", file=stream)
+        if clear:
+            self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.dropped = 0
+        self._next = 0
+
 class Logger:
 
     level = NOTSET
-    handlers = []
     record = LogRecord()
 
     def __init__(self, name):
         self.name = name
+        self.handlers = []  # of this logger only, others keep printing
+        self._min = _level  # effective level, kept up to date by setLevel and basicConfig
 
     def _level_str(self, level):
         l = _level_dict.get(level)
@@ -48,40 +195,47 @@ class Logger:
 
     def setLevel(self, level):
         self.level = level
+        self._min = level or _level
 
     def isEnabledFor(self, level):
-        return level >= (self.level or _level)
+        return level >= self._min
 
     def log(self, level, msg, *args):
-        if self.isEnabledFor(level):
+        if level >= self._min:
             levelname = self._level_str(level)
-            if args:
-                msg = msg % args
             if self.handlers:
                 d = self.record.__dict__
                 d["levelname"] = levelname
                 d["levelno"] = level
-                d["message"] = msg
+                d["msg"] = msg
+                d["args"] = args
                 d["name"] = self.name
                 for h in self.handlers:
                     h.emit(self.record)
             else:
+                if args:
+                    msg = msg % args
                 print(levelname, ":", self.name, ":", msg, sep="", file=_stream)
 
     def debug(self, msg, *args):
-        self.log(DEBUG, msg, *args)
+        if DEBUG >= self._min:
+            self.log(DEBUG, msg, *args)
 
     def info(self, msg, *args):
-        self.log(INFO, msg, *args)
+        if INFO >= self._min:
+            self.log(INFO, msg, *args)
 
     def warning(self, msg, *args):
-        self.log(WARNING, msg, *args)
+        if WARNING >= self._min:
+            self.log(WARNING, msg, *args)
 
     def error(self, msg, *args):
-        self.log(ERROR, msg, *args)
+        if ERROR >= self._min:
+            self.log(ERROR, msg, *args)
 
     def critical(self, msg, *args):
-        self.log(CRITICAL, msg, *args)
+        if CRITICAL >= self._min:
+            self.log(CRITICAL, msg, *args)
 
     def exc(self, e, msg, *args):
         self.log(ERROR, msg, *args)
@@ -112,6 +266,8 @@ def debug(msg, *args):
 def basicConfig(level=INFO, filename=None, stream=None, format=None):
     global _level, _stream
     _level = level
+    for l in _loggers.values():
+        l._min = l.level or _level
     if stream:
         _stream = stream
     if filename is not None:
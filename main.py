@@ -28,8 +28,11 @@ def demo_motors_timed(movehub):
     for level in range(0, 101, 10):
         level /= 100.0
         log.info("Speed level: %s%%", level * 100)
-        movehub.motor_A.timed(0.2, level)
-        movehub.motor_B.timed(0.2, -level)
+        # both motors start at once, then we wait for both to finish
+        movehub.wait_all([
+            movehub.motor_A.timed(0.2, level, wait=False),
+            movehub.motor_B.timed(0.2, -level, wait=False),
+        ])
     movehub.motor_AB.timed(1.5, -0.2, 0.2)
     movehub.motor_AB.timed(0.5, 1)
     movehub.motor_AB.timed(0.5, -1)
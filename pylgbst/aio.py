@@ -0,0 +1,443 @@
+"""
+Asynchronous flavour of the hub and peripherals, for uasyncio on MicroPython and asyncio on CPython.
+
+Requests and motor commands return awaitables instead of blocking the caller,
+sensor values are read with `async for value in hub.tilt_sensor.stream(): ...`
+
+    hub = AsyncMoveHub()
+    await hub.start()
+    await hub.motor_A.timed(1.0)
+"""
+import logging
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from pylgbst.hub import Hub, MoveHub, PendingReply, ReplyTimeout
+from pylgbst.messages import MsgGenericError, MsgHubAttachedIO, MsgHubProperties, MsgPortInfo, MsgPortInfoRequest, \
+    MsgPortInputFmtSingle, MsgPortModeInfo, MsgPortModeInfoRequest, MsgPortOutput
+from pylgbst.peripherals import Peripheral, GenericPeripheral, Motor, EncodedMotor, LEDRGB, TiltSensor, VisionSensor, \
+    Voltage, Current, Button
+from pylgbst.utilities import ticks_add, ticks_diff, ticks_ms
+
+log = logging.getLogger('aio')
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:
+    class ThreadSafeFlag(object):
+        """
+        Stand-in for uasyncio.ThreadSafeFlag, CPython BLE backends notify from their own threads
+        """
+
+        def __init__(self):
+            self._loop = asyncio.get_event_loop()
+            self._event = asyncio.Event()
+
+        def set(self):
+            self._loop.call_soon_threadsafe(self._event.set)
+
+        async def wait(self):
+            await self._event.wait()
+            self._event.clear()
+
+
+async def wait_until(condition, timeout, interval=0.005):
+    """
+    Polls condition until it is true, for the states that get changed from BLE handlers
+
+    :param timeout: seconds, None to wait forever
+
+    :return: False if timeout has expired first
+    """
+    deadline = None if timeout is None else ticks_add(ticks_ms(), int(timeout * 1000))
+    while not condition():
+        if deadline is not None and ticks_diff(deadline, ticks_ms()) <= 0:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+class AsyncPendingReply(PendingReply):
+    def __init__(self, hub, request, seq):
+        super(AsyncPendingReply, self).__init__(hub, request, seq)
+        self._flag = ThreadSafeFlag()
+
+    def set_reply(self, msg):
+        super(AsyncPendingReply, self).set_reply(msg)
+        self._flag.set()
+
+    async def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait for the reply, hub's REPLY_TIMEOUT by default
+        :rtype: pylgbst.messages.UpstreamMsg
+        """
+        if timeout is None:
+            timeout = self.hub.REPLY_TIMEOUT
+
+        self.hub.flush()
+        if self.reply is None:
+            try:
+                await asyncio.wait_for(self._flag.wait(), timeout)
+            except asyncio.TimeoutError:
+                self._timed_out(timeout)
+                while self.reply is None:
+                    await self._flag.wait()
+
+        log.debug("Fetched async reply: %r", self.reply)
+        return self._result()
+
+
+class PortStream(object):
+    """
+    Async iterator over the values of a peripheral's port.
+    Subscribes on first iteration, keeps at most `maxlen` values and drops the oldest ones
+    if the consumer is slower than the sensor, counting them in `dropped`.
+    Operators given in `ops` thin the values out before they are queued, see Peripheral.subscribe.
+    """
+
+    def __init__(self, peripheral, mode, granularity=1, maxlen=16, ops=()):
+        self.peripheral = peripheral
+        self.mode = mode
+        self.granularity = granularity
+        self.ops = ops
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._queue = []
+        self._flag = None
+        self._callback = self._push  # the same object to subscribe and unsubscribe with
+
+    def _push(self, value):
+        if len(self._queue) >= self.maxlen:
+            self._queue.pop(0)
+            self.dropped += 1
+        self._queue.append(value)
+        self._flag.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._flag is None:
+            self._flag = ThreadSafeFlag()
+            await self.peripheral.subscribe(self._callback, self.mode, self.granularity, self.ops)
+
+        while not self._queue:
+            await self._flag.wait()
+        return self._queue.pop(0)
+
+    async def close(self):
+        if self._flag is not None:
+            await self.peripheral.unsubscribe(self._callback)
+            self._flag = None
+        if self.dropped:
+            log.debug("%s dropped %s values", self.peripheral, self.dropped)
+
+
+# mixins have no base class and go first in the bases list,
+# MicroPython looks methods up depth-first and would find sync versions otherwise
+
+class AsyncPeripheralMixin:
+    DEFAULT_MODE = 0x00
+
+    __slots__ = ()
+
+    async def set_port_mode(self, mode, send_updates=None, update_delta=None):
+        msg = self._port_mode_request(mode, send_updates, update_delta)
+        if msg:
+            resp = await self.hub.send(msg)
+            assert isinstance(resp, MsgPortInputFmtSingle)
+            self._use_port_mode(resp)
+
+    async def get_sensor_data(self, mode):
+        await self.set_port_mode(mode)
+        msg = MsgPortInfoRequest(self.port, MsgPortInfoRequest.INFO_PORT_VALUE)
+        resp = await self.hub.send(msg)
+        return self._decode_port_data(resp)
+
+    async def subscribe(self, callback, mode=None, granularity=1, ops=()):
+        if mode is None:
+            mode = self.DEFAULT_MODE
+        if (self._port_mode.mode != mode or self._combined) and self._subscribers:
+            raise ValueError("Port is in active mode %r, unsubscribe all subscribers first" % self._port_mode)
+        await self.set_port_mode(mode, True, granularity)
+        if callback:
+            self._add_subscriber(callback, ops)
+
+    async def subscribe_combined(self, callback, modes, granularity=1, ops=()):
+        if self._subscribers:
+            raise ValueError("Port is in active mode %r, unsubscribe all subscribers first" % self._port_mode)
+        index, values = self._combined_plan(await self.describe_possible_modes(), modes)
+        replies = await self.hub.send_all(self._combined_requests(index, values, granularity))
+        self._start_combined(values, replies)
+        if callback:
+            self._add_subscriber(callback, ops)
+
+    async def unsubscribe(self, callback=None):
+        self._remove_subscriber(callback)
+
+        if not self._port_mode.upd_enabled:
+            log.warning("Attempt to unsubscribe while port value updates are off: %s", self)
+        elif not self._subscribers:
+            if self._combined:
+                self._combined = None
+                await self.hub.send(self._combined_reset())
+            await self.set_port_mode(self._port_mode.mode, False)
+
+    async def describe_possible_modes(self):
+        key = self.capability_key()
+        info = self.hub.capabilities.get(key) if key else None
+        if info is None:
+            info = await self._query_possible_modes()
+            if key:
+                self.hub.capabilities.put(key, info)
+
+        log.debug("Port info for 0x%x: %s", self.port, info)
+        return info
+
+    async def _query_possible_modes(self):
+        mode_info = await self.hub.send(MsgPortInfoRequest(self.port, MsgPortInfoRequest.INFO_MODE_INFO))
+        assert isinstance(mode_info, MsgPortInfo)
+        info = {
+            "mode_count": mode_info.total_modes,
+            "input_modes": [],
+            "output_modes": [],
+            "capabilities": {
+                "logically_combinable": mode_info.is_combinable(),
+                "synchronizable": mode_info.is_synchronizable(),
+                "can_output": mode_info.is_output(),
+                "can_input": mode_info.is_input(),
+            }
+        }
+
+        if mode_info.is_combinable():
+            request = MsgPortInfoRequest(self.port, MsgPortInfoRequest.INFO_MODE_COMBINATIONS)
+            mode_combinations = await self.hub.send(request)
+            assert isinstance(mode_combinations, MsgPortInfo)
+            info['possible_mode_combinations'] = mode_combinations.possible_mode_combinations
+
+        info['modes'] = []
+        for mode in range(mode_info.total_modes):
+            info['modes'].append(await self._describe_mode(mode))
+
+        for mode in mode_info.output_modes:
+            info['output_modes'].append(info['modes'][mode])
+
+        for mode in mode_info.input_modes:
+            info['input_modes'].append(info['modes'][mode])
+
+        return info
+
+    async def _describe_mode(self, mode):
+        descr = {"Mode": mode}
+        pendings = [(info, name, self.hub.request(MsgPortModeInfoRequest(self.port, mode, info)))
+                    for info, name in MsgPortModeInfoRequest.INFO_TYPES]
+        for index, (info, name, pending) in enumerate(pendings):
+            try:
+                resp = await pending.wait()
+            except RuntimeError:
+                if not isinstance(pending.reply, MsgGenericError):
+                    self._forget_pendings(pendings[index + 1:])
+                    raise
+                log.debug("Mode %s has no info 0x%x: %s", mode, info, pending.reply.message())
+                continue
+            assert isinstance(resp, MsgPortModeInfo)
+            descr[name] = resp.value
+        return descr
+
+    async def _send_output(self, msg, wait=True):
+        msg.is_buffered = self.is_buffered
+        if msg.is_buffered:
+            self._queue_output(msg)
+            return None
+        if not wait:
+            return self.hub.request(msg)
+        return await self.hub.send(msg)
+
+    async def wait_output(self, timeout=None):
+        """
+        Waits for buffered commands to complete
+
+        :return: False if timeout has expired first
+        """
+        return await wait_until(self._output_drained.is_set, timeout)
+
+    def stream(self, mode=None, granularity=1, maxlen=16, ops=()):
+        """
+        :rtype: PortStream
+        """
+        if mode is None:
+            mode = self.DEFAULT_MODE
+        return PortStream(self, mode, granularity, maxlen, ops)
+
+
+class AsyncPeripheral(AsyncPeripheralMixin, Peripheral):
+    pass
+
+
+class AsyncGenericPeripheral(AsyncPeripheralMixin, GenericPeripheral):
+    def _mode_info(self):
+        # describing modes means waiting for replies, values get decoded once the cache knows the device,
+        # `await peripheral.describe_possible_modes()` puts it there
+        key = self.capability_key()
+        return self.hub.capabilities.get(key) if key else None
+
+
+class AsyncLEDRGB(AsyncPeripheralMixin, LEDRGB):
+    async def set_color(self, color, wait=True):
+        mode, fmt, params = self._color_params(color)
+        await self.set_port_mode(mode)
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, fmt, params)
+        return await self._send_output(msg, wait)
+
+
+class AsyncMotor(AsyncPeripheralMixin, Motor):
+    pass
+
+
+class AsyncEncodedMotor(AsyncPeripheralMixin, EncodedMotor):
+    DEFAULT_MODE = EncodedMotor.SENSOR_ANGLE
+
+
+class AsyncTiltSensor(AsyncPeripheralMixin, TiltSensor):
+    DEFAULT_MODE = TiltSensor.MODE_3AXIS_SIMPLE
+
+
+class AsyncVisionSensor(AsyncPeripheralMixin, VisionSensor):
+    DEFAULT_MODE = VisionSensor.COLOR_DISTANCE_FLOAT
+
+    async def set_color(self, color, wait=True):
+        params = self._color_params(color)
+        await self.set_port_mode(self.SET_COLOR)
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, self.LAYOUT_SET_COLOR, params)
+        return await self._send_output(msg, wait)
+
+    async def set_ir_tx(self, level=1.0, wait=True):
+        params = self._ir_tx_params(level)
+        await self.set_port_mode(self.SET_IR_TX)
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, self.LAYOUT_SET_IR_TX, params)
+        return await self._send_output(msg, wait)
+
+
+class AsyncVoltage(AsyncPeripheralMixin, Voltage):
+    pass
+
+
+class AsyncCurrent(AsyncPeripheralMixin, Current):
+    pass
+
+
+class AsyncButton(Button):
+    async def subscribe(self, callback, mode=None, granularity=1):
+        await self.hub.send(MsgHubProperties(MsgHubProperties.BUTTON, MsgHubProperties.UPD_ENABLE))
+
+        if callback:
+            self._subscribers.add(callback)
+
+    async def unsubscribe(self, callback=None):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+        if not self._subscribers:
+            await self.hub.send(MsgHubProperties(MsgHubProperties.BUTTON, MsgHubProperties.UPD_DISABLE))
+
+
+ASYNC_PERIPHERAL_TYPES = {
+    MsgHubAttachedIO.DEV_MOTOR: AsyncMotor,
+    MsgHubAttachedIO.DEV_MOTOR_EXTERNAL_TACHO: AsyncEncodedMotor,
+    MsgHubAttachedIO.DEV_MOTOR_INTERNAL_TACHO: AsyncEncodedMotor,
+    MsgHubAttachedIO.DEV_VISION_SENSOR: AsyncVisionSensor,
+    MsgHubAttachedIO.DEV_RGB_LIGHT: AsyncLEDRGB,
+    MsgHubAttachedIO.DEV_TILT_EXTERNAL: AsyncTiltSensor,
+    MsgHubAttachedIO.DEV_TILT_INTERNAL: AsyncTiltSensor,
+    MsgHubAttachedIO.DEV_CURRENT: AsyncCurrent,
+    MsgHubAttachedIO.DEV_VOLTAGE: AsyncVoltage,
+}
+
+
+class AsyncHubMixin:
+    """
+    Constructor only connects, `await hub.start()` before use
+    """
+    PERIPHERAL_TYPES = ASYNC_PERIPHERAL_TYPES
+    DEFAULT_PERIPHERAL = AsyncGenericPeripheral
+    PENDING_REPLY_CLASS = AsyncPendingReply
+
+    def _start(self):
+        pass  # can't block in constructor, see start()
+
+    async def start(self):
+        await self._connect()
+        self._set_ready()
+
+    async def _connect(self):
+        if not await wait_until(lambda: self.connection.wait_ready(0), self.CONNECT_TIMEOUT):
+            raise RuntimeError("Connection is not ready within %ss" % self.CONNECT_TIMEOUT)
+        self._frames.reset()  # nothing left of a message from previous connection
+        self.connection.enable_notifications()
+        self.state = self.STATE_CONNECTED
+
+    async def send(self, msg, timeout=None):
+        """
+        :type msg: pylgbst.messages.DownstreamMsg
+        :rtype: pylgbst.messages.UpstreamMsg
+        """
+        pending = self.request(msg)
+        if pending is None:
+            self.flush()
+            return None
+        return await pending.wait(timeout)
+
+    async def send_all(self, msgs, timeout=None):
+        """
+        :rtype: list[pylgbst.messages.UpstreamMsg]
+        """
+        return await self.wait_all([self.request(msg) for msg in msgs], timeout)
+
+    async def wait_all(self, pendings, timeout=None):
+        """
+        :type pendings: list[AsyncPendingReply]
+        :param timeout: seconds to wait for all of them
+        :rtype: list[pylgbst.messages.UpstreamMsg]
+        """
+        self.flush()
+        deadline = None if timeout is None else ticks_add(ticks_ms(), int(timeout * 1000))
+        replies = []
+        for pending in pendings:  # no await in comprehensions on MicroPython
+            if deadline is not None:
+                timeout = max(0, ticks_diff(deadline, ticks_ms())) / 1000.0
+            replies.append((await pending.wait(timeout)) if pending else None)
+        return replies
+
+
+class AsyncHub(AsyncHubMixin, Hub):
+    pass
+
+
+class AsyncMoveHub(AsyncHubMixin, MoveHub):
+    BUTTON_CLASS = AsyncButton
+
+    async def start(self):
+        await self._connect()
+        pendings = [self.request(msg) for msg in self._status_requests()] if self.report_status else ()
+        await self._wait_for_devices()
+        self._set_ready()
+        if pendings:
+            replies = []
+            for pending in pendings:
+                replies.append(await pending.wait())
+            self._log_status(replies)
+
+    async def _wait_for_devices(self, get_dev_set=None, timeout=10):
+        if not get_dev_set:
+            get_dev_set = self._builtin_devices
+        if await wait_until(lambda: all(get_dev_set()), timeout):
+            log.debug("All devices are present: %s", get_dev_set())
+            return True
+        log.warning("Got only these devices: %s", get_dev_set())
+        return False
+
+    async def _report_status(self):
+        self._log_status(await self.send_all(self._status_requests()))
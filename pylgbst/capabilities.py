@@ -0,0 +1,115 @@
+"""
+Port and mode capabilities of devices, kept on flash (or disk) between runs.
+Devices are identified by type and hardware/software revisions,
+so a device described once needs no radio traffic to be described again.
+"""
+import logging
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from pylgbst.utilities import RLock
+
+log = logging.getLogger('capabilities')
+
+
+def _default_filename():
+    try:
+        import os.path
+    except ImportError:  # MicroPython, the board's internal filesystem
+        return "/flash/pylgbst_caps.json"
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pylgbst", "caps.json")
+
+
+class CapabilityCache(object):
+    """
+    Dict of Peripheral.describe_possible_modes results, stored as a single JSON file.
+    Hubs share one instance per file, see shared(), so none of them overwrites what the others stored.
+    """
+    DEFAULT_FILENAME = _default_filename()  # /flash on the board, user's cache directory with CPython
+
+    _instances = {}  # filename -> CapabilityCache
+    _instances_lock = RLock()  # fleet connects hubs from several threads with CPython
+
+    def __init__(self, filename=DEFAULT_FILENAME):
+        """
+        :param filename: None to keep descriptions in memory only
+        """
+        self.filename = filename
+        self._entries = None  # loaded on first use
+        self._lock = RLock()
+
+    @classmethod
+    def shared(cls, filename=DEFAULT_FILENAME):
+        """
+        :return: the instance of that file, a new one to keep in memory only when filename is None
+        """
+        if filename is None:
+            return cls(None)
+        with cls._instances_lock:
+            cache = cls._instances.get(filename)
+            if cache is None:
+                cache = cls._instances[filename] = cls(filename)
+            return cache
+
+    @staticmethod
+    def key(dev_type, hw_revision, sw_revision):
+        return "%04x-%08x-%08x" % (dev_type, hw_revision, sw_revision)
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+
+        entries = {}
+        if self.filename:
+            try:
+                with open(self.filename) as fhd:
+                    entries = json.load(fhd)
+            except OSError:
+                log.debug("No capability cache in %s yet", self.filename)
+            except ValueError:
+                log.warning("Capability cache %s is damaged, starting over", self.filename)
+        self._entries = entries
+        return self._entries
+
+    def get(self, key):
+        """
+        :rtype: dict
+        :return: None if device is unknown
+        """
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, info):
+        try:
+            json.dumps(info)  # checked alone first, not to write a half of the file
+        except (TypeError, ValueError) as exc:
+            log.warning("Can't store capabilities of %s: %s", key, exc)
+            return
+
+        with self._lock:
+            entries = self._load()
+            entries[key] = info
+            if self.filename:
+                self._store(entries)
+
+    def _store(self, entries):
+        try:
+            text = json.dumps(entries)
+            self._make_dirs()
+            with open(self.filename, "w") as fhd:
+                fhd.write(text)
+        except OSError:
+            log.warning("Failed to store capability cache in %s", self.filename)
+
+    def _make_dirs(self):
+        try:
+            import os.path
+        except ImportError:
+            return  # /flash is always there
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
@@ -0,0 +1,154 @@
+"""
+Message codecs generated from field declarations.
+
+Message classes declare FIELDS, a tuple of (name, struct format) or (name, struct format, condition) items,
+in the order they go on the wire after the common header. From those, compile_codec() generates
+a decode function reading header and fields with as few unpack_from calls as there are
+groups of fields, into a new message or the one given for reuse, and an encode function packing them in one go.
+Condition is a Python expression over msg and remaining (bytes left in frame):
+field is decoded when it is true and encoded when it is not None.
+Whatever does not fit a fixed layout is left to _decode_tail() and _encode_tail() methods of the class,
+which are None when there is nothing to do.
+"""
+from ustruct import calcsize, pack, unpack_from
+
+MAX_SHORT_LEN = 127  # longer messages encode length in 2 bytes
+
+
+def decode_length(data, offset=0):
+    """
+    see https://lego.github.io/lego-ble-wireless-protocol-docs/#message-length-encoding
+
+    :return: tuple of message length, header included, and size of length field, None if data is too short to tell
+    """
+    msglen = data[offset]
+    if not msglen & 0x80:
+        return msglen, 1
+    if len(data) < offset + 2:
+        return None
+    return (msglen & 0x7f) | (data[offset + 1] << 7), 2
+
+
+def frame(hub_id, msg_type, payload):
+    """
+    see https://lego.github.io/lego-ble-wireless-protocol-docs/#common-message-header
+    """
+    msglen = len(payload) + 3
+    if msglen > MAX_SHORT_LEN:
+        msglen += 1
+        return pack("<BBBB", (msglen & 0x7f) | 0x80, msglen >> 7, hub_id, msg_type) + payload
+    return pack("<BBB", msglen, hub_id, msg_type) + payload
+
+
+def _groups(fields):
+    """
+    Splits fields into runs packed together: unconditional ones, and the ones sharing a condition
+
+    :return: list of (condition, names, format)
+    """
+    groups = []
+    for field in fields:
+        name, fmt = field[0], field[1]
+        cond = field[2] if len(field) > 2 else None
+        if groups and groups[-1][0] == cond:
+            groups[-1][1].append(name)
+            groups[-1][2].append(fmt)
+        else:
+            groups.append((cond, [name], [fmt]))
+    return [(cond, names, "".join(fmts)) for cond, names, fmts in groups]
+
+
+def _targets(names):
+    return "".join("msg.%s, " % name for name in names)
+
+
+def _decode_source(cls):
+    groups = _groups(cls.FIELDS)
+    if groups and groups[0][0] is None:
+        first_names, first_fmt = groups[0][1], groups[0][2]
+        groups = groups[1:]
+    else:
+        first_names, first_fmt = [], ""
+    size = calcsize("<" + first_fmt)
+    lines = [
+        "def decode(cls, data, msg=None):",
+        "    if msg is None:",
+        "        msg = cls()",
+        "    msg.payload = memoryview(data)",
+        "    if data[0] & 0x80:",
+        "        msglen, msglen_hi, hub_id, msg_type, %s= unpack_from(%r, data, 0)"
+        % (_targets(first_names), "<BBBB" + first_fmt),
+        "        msglen = (msglen & 0x7f) | (msglen_hi << 7)",
+        "        pos = %s" % (4 + size),
+        "    else:",
+        "        msglen, hub_id, msg_type, %s= unpack_from(%r, data, 0)" % (_targets(first_names), "<BBB" + first_fmt),
+        "        pos = %s" % (3 + size),
+        "    assert msglen == len(data), 'Message length does not match: %s!=%s' % (msglen, len(data))",
+        "    assert hub_id == 0",
+        "    assert msg_type == cls.TYPE, 'Message type does not match: %x!=%x' % (cls.TYPE, msg_type)",
+    ]
+    for cond, names, fmt in groups:
+        indent = "    "
+        if cond is not None:
+            if "remaining" in cond:
+                lines.append("    remaining = msglen - pos")
+            lines.append("    if %s:" % cond)
+            indent = "        "
+        lines.append(indent + "%s= unpack_from(%r, data, pos)" % (_targets(names), "<" + fmt))
+        lines.append(indent + "pos += %s" % calcsize("<" + fmt))
+    lines.append("    msg._pos = pos")
+    if cls._decode_tail is not None:
+        lines.append("    msg._decode_tail()")
+    lines.append("    return msg")
+    return "\n".join(lines) + "\n"
+
+
+def _values(names):
+    return "".join(", msg.%s" % name for name in names)
+
+
+def _encode_source(cls):
+    groups = _groups(cls.FIELDS)
+    has_tail = cls._encode_tail is not None
+    lines = ["def _encode(msg):"]
+    if has_tail:
+        lines.append("    tail = msg._encode_tail()")
+
+    if all(cond is None for cond, _, _ in groups):
+        names = [name for _, group_names, _ in groups for name in group_names]
+        fmt = "".join(group_fmt for _, _, group_fmt in groups)
+        size = 3 + calcsize("<" + fmt)
+        if has_tail:
+            lines.append("    size = %s + len(tail)" % size)
+            lines.append("    if size > %s:" % MAX_SHORT_LEN)
+            lines.append("        return frame(msg.hub_id, msg.TYPE, pack(%r%s) + tail)" % ("<" + fmt, _values(names)))
+            lines.append("    return pack(%r, size, msg.hub_id, msg.TYPE%s) + tail" % ("<BBB" + fmt, _values(names)))
+        else:
+            assert size <= MAX_SHORT_LEN
+            lines.append("    return pack(%r, %s, msg.hub_id, msg.TYPE%s)" % ("<BBB" + fmt, size, _values(names)))
+        return "\n".join(lines) + "\n"
+
+    lines.append("    body = b''")
+    for cond, names, fmt in groups:
+        indent = "    "
+        if cond is not None:
+            lines.append("    if %s:" % " and ".join("msg.%s is not None" % name for name in names))
+            indent = "        "
+        lines.append(indent + "body += pack(%r%s)" % ("<" + fmt, _values(names)))
+    if has_tail:
+        lines.append("    body += tail")
+    lines.append("    return frame(msg.hub_id, msg.TYPE, body)")
+    return "\n".join(lines) + "\n"
+
+
+def compile_codec(cls, decode=True, encode=True):
+    """
+    Generates decode() and _encode() of message class from its FIELDS
+    """
+    for is_wanted, source_func in ((decode, _decode_source), (encode, _encode_source)):
+        if not is_wanted:
+            continue
+        generated = {}
+        exec(source_func(cls), globals(), generated)
+        for name, func in generated.items():
+            setattr(cls, name, func)
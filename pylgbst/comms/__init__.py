@@ -11,19 +11,42 @@ from binascii import unhexlify
 #from threading import Thread
 
 from pylgbst.messages import MsgHubAction
-from pylgbst.utilities import str2hex
+from pylgbst.utilities import OneShotTimer, RLock, const, str2hex, ticks_diff, ticks_ms
 
 #log = logging.getLogger('comms')
 
 MOVE_HUB_HW_UUID_SERV = '00001623-1212-efde-1623-785feabcd123'
 MOVE_HUB_HW_UUID_CHAR = '00001624-1212-efde-1623-785feabcd123'
-ENABLE_NOTIFICATIONS_HANDLE = 0x000f
+ENABLE_NOTIFICATIONS_HANDLE = const(0x000f)
 ENABLE_NOTIFICATIONS_VALUE = b'\x01\x00'
 
-MOVE_HUB_HARDWARE_HANDLE = 0x0E
+MOVE_HUB_HARDWARE_HANDLE = const(0x0E)
+
+DEFAULT_MAX_WRITE = const(20)  # default ATT_MTU of 23 minus 3 bytes of ATT header
+
+
+def pack_frames(frames, max_size):
+    """
+    Groups consecutive messages into chunks of at most max_size bytes, a longer message makes a chunk alone
+
+    :type frames: list[bytes]
+    :rtype: list[bytes]
+    """
+    chunks = []
+    chunk = b""
+    for frame in frames:
+        if chunk and len(chunk) + len(frame) > max_size:
+            chunks.append(chunk)
+            chunk = b""
+        chunk += frame
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 
 class Connection(object):
+    max_write = DEFAULT_MAX_WRITE  # bytes per write, backends update it once MTU is negotiated
+
     def connect(self, hub_mac=None):
         pass
 
@@ -42,9 +65,24 @@ class Connection(object):
     def set_notify_handler(self, handler):
         pass
 
+    def write_many(self, handle, frames):
+        """
+        Writes several messages with as few writes as max_write allows
+        """
+        for chunk in pack_frames(frames, self.max_write):
+            self.write(handle, chunk)
+
     def enable_notifications(self):
         pass
 
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until the hub can be talked to, connections which connect in background override it
+
+        :return: False if timeout has expired first
+        """
+        return True
+
     def _is_device_matched(self, address, dev_name, hub_mac, find_name):
         assert hub_mac or find_name, 'You have to provide either hub_mac or hub_name in connection options'
         print("Checking device: %s, MAC: %s", dev_name, address)
@@ -60,3 +98,66 @@ class Connection(object):
                 print("Found %s at %s", dev_name, address)
 
         return matched
+
+
+class WriteBatcher(object):
+    """
+    Collects messages on their way to the hub and writes them in one go.
+    Flushes when the next message would not fit into a single write,
+    when the oldest collected message has waited budget_ms, or on explicit flush().
+    """
+    BUDGET_MS = 10
+
+    def __init__(self, connection, handle, max_size=None, budget_ms=BUDGET_MS, lock=None):
+        """
+        :type connection: Connection
+        :param lock: pylgbst.utilities.RLock the caller holds around add() and flush(), taken by the budget timer too
+        """
+        self.connection = connection
+        self.handle = handle
+        self.max_size = max_size
+        self.budget_ms = budget_ms
+        self.lock = lock or RLock()
+        self._frames = []
+        self._size = 0
+        self._since = 0
+        self._timer = OneShotTimer(self._budget_expired)
+
+    def add(self, data):
+        max_size = self.max_size or self.connection.max_write
+        if self._frames and (self._size + len(data) > max_size
+                             or ticks_diff(ticks_ms(), self._since) >= self.budget_ms):
+            self.flush()
+
+        if not self._frames:
+            self._since = ticks_ms()
+            self._timer.start(self.budget_ms)
+        self._frames.append(bytes(data))  # messages may be packed in reused buffers, see MsgLayout
+        self._size += len(data)
+
+        if self._size >= max_size:
+            self.flush()
+
+    def holds_back(self):
+        """
+        :return: True if collected messages may wait for the next add() or flush(), there is no timer to flush them
+        """
+        return not OneShotTimer.available()
+
+    def _budget_expired(self):
+        # without threads the timer interrupts the caller, maybe in the middle of add() or flush():
+        # run_exclusive() leaves it to the caller then, to flush as it releases the lock
+        self.lock.run_exclusive(self._flush_locked)
+
+    def _flush_locked(self):
+        with self.lock:
+            self.flush()
+
+    def flush(self):
+        self._timer.cancel()
+        if not self._frames:
+            return
+        frames = self._frames
+        self._frames = []
+        self._size = 0
+        self.connection.write_many(self.handle, frames)
@@ -3,13 +3,15 @@
 
 import bluetooth
 import random
+from array import array
 import struct
 import time
 import micropython
 import logging
 from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_SERV, MOVE_HUB_HW_UUID_CHAR, \
-    MOVE_HUB_HARDWARE_HANDLE
+    MOVE_HUB_HARDWARE_HANDLE, DEFAULT_MAX_WRITE, pack_frames
 from pylgbst.comms.ble_advertising import decode_services, decode_name
+from pylgbst.utilities import Event
 
 from micropython import const
 
@@ -32,11 +34,16 @@ _IRQ_GATTC_READ_DONE = const(16)
 _IRQ_GATTC_WRITE_DONE = const(17)
 _IRQ_GATTC_NOTIFY = const(18)
 _IRQ_GATTC_INDICATE = const(19)
+_IRQ_MTU_EXCHANGED = const(21)
 
 _ADV_IND = const(0x00)
 _ADV_DIRECT_IND = const(0x01)
 _ADV_SCAN_IND = const(0x02)
 _ADV_NONCONN_IND = const(0x03)
+_ADV_SCAN_RSP = const(0x04)
+
+_ATT_HEADER_SIZE = const(3)
+_PREFERRED_MTU = const(185)  # we propose it, the hub may answer with less
 
 _HUB_CHAR_UUID = bluetooth.UUID("00001624-1212-efde-1623-785feabcd123")
 _HUB_SERVICE_UUID = bluetooth.UUID("00001623-1212-efde-1623-785feabcd123")
@@ -46,12 +53,159 @@ ENABLE_NOTIFICATIONS_VALUE = b'\x01\x00'
 
 log = logging.getLogger('ble')
 
+# BLE has a single IRQ handler, it is shared by all the connections (and scanner),
+# each of them picks the events of its own connection handle
+_irq_listeners = []
+
+
+def _irq(event, data):
+    for listener in _irq_listeners:
+        listener._irq(event, data)
+
+
+def _listen_irq(ble, listener):
+    if listener not in _irq_listeners:
+        _irq_listeners.append(listener)
+    ble.irq(_irq)
+
+
+def _unlisten_irq(listener):
+    if listener in _irq_listeners:
+        _irq_listeners.remove(listener)
+
+
+class NotificationRing(object):
+    """
+    Notifications as the IRQ handler got them, kept in preallocated slots until they are handled
+    outside of IRQ context. IRQ handler only copies the data into the next free slot, then schedules
+    drain() with micropython.schedule, or wakes run() task when it is used instead.
+
+    One IRQ handler fills it and one drain empties it, head and tail are each moved by one side only,
+    so neither has to wait for the other.
+    Notifications that come while all the slots are taken are dropped and counted in `overflows`,
+    longer than a slot in `oversized`.
+    """
+
+    def __init__(self, callback=None, slots=16, slot_size=_PREFERRED_MTU - _ATT_HEADER_SIZE):
+        """
+        :param callback: called with (handle, data) for every notification, data is a copy owned by callee
+        """
+        self.callback = callback
+        self.slot_size = slot_size
+        self._size = slots + 1  # one slot always stays free to tell full from empty
+        self._slots = [bytearray(slot_size) for _ in range(self._size)]
+        self._lengths = array('H', [0] * self._size)
+        self._handles = array('H', [0] * self._size)
+        self._head = 0  # next slot to fill, moved by IRQ handler
+        self._tail = 0  # next slot to handle, moved by drain
+        self._pending = False  # drain is scheduled or task is woken, no need to ask again
+        self._flag = None
+        self._drain_ref = self.drain  # bound method allocated once, not in every IRQ
+
+        self.received = 0
+        self.overflows = 0
+        self.oversized = 0
+        self.schedule_failures = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return (self._head - self._tail) % self._size
+
+    def put(self, handle, data):
+        """
+        Called in IRQ handler, does no more than a copy and a few index updates
+        """
+        self.received += 1
+        length = len(data)
+        if length > self.slot_size:
+            self.oversized += 1
+            return
+
+        head = self._head
+        following = head + 1
+        if following == self._size:
+            following = 0
+        if following == self._tail:
+            self.overflows += 1
+            return
+
+        self._slots[head][0:length] = data
+        self._lengths[head] = length
+        self._handles[head] = handle
+        self._head = following
+
+        queued = (following - self._tail) % self._size
+        if queued > self.high_water:
+            self.high_water = queued
+
+        if not self._pending:
+            self._pending = True
+            if self._flag is not None:
+                self._flag.set()
+            else:
+                try:
+                    micropython.schedule(self._drain_ref, None)
+                except RuntimeError:  # schedule queue is full, next notification will ask again
+                    self._pending = False
+                    self.schedule_failures += 1
+
+    def drain(self, _=None):
+        """
+        Hands every notification held to the callback, in the order they came
+        """
+        self._pending = False
+        tail = self._tail
+        while tail != self._head:
+            handle = self._handles[tail]
+            data = bytes(memoryview(self._slots[tail])[:self._lengths[tail]])
+            tail += 1
+            if tail == self._size:
+                tail = 0
+            self._tail = tail  # slot is copied, IRQ handler may fill it again while callback runs
+
+            if self.callback:
+                try:
+                    self.callback(handle, data)
+                except Exception as e:
+                    log.exc(e, "Failed to handle notification")
+
+    async def run(self):
+        """
+        Task draining the ring under uasyncio, instead of micropython.schedule
+        """
+        import uasyncio
+
+        self._flag = uasyncio.ThreadSafeFlag()
+        try:
+            while True:
+                self.drain()
+                await self._flag.wait()
+        finally:
+            self._flag = None
+
+    def clear(self):
+        self._tail = self._head
+        self._pending = False
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        return {"received": self.received, "overflows": self.overflows, "oversized": self.oversized,
+                "schedule_failures": self.schedule_failures, "high_water": self.high_water, "queued": len(self)}
+
+
 class BLESimpleCentral:
     def __init__(self, ble):
         self._ble = ble
         self._ble.active(True)
-        self._ble.irq(self._irq)
+        try:
+            self._ble.config(mtu=_PREFERRED_MTU)
+        except (ValueError, TypeError):
+            log.warning("Can't configure MTU, using default")
+        self.notifications = NotificationRing(self._deliver)
         self._reset()
+        _listen_irq(self._ble, self)
 
     def _reset(self):
         # Cached name and address from a successful scan.
@@ -61,21 +215,26 @@ class BLESimpleCentral:
 
         # Callbacks for completion of various operations.
         # These reset back to None after being invoked.
+        self._scanning = False
         self._scan_callback = None
         self._conn_callback = None
         self._read_callback = None
 
         # Persistent callback for when new data is notified from the device.
         self._notify_callback = None
+        self.notifications.clear()
 
         # Connected device.
         self._conn_handle = None
         self._start_handle = None
         self._end_handle = None
         self._char_handle = None
+        self.mtu = DEFAULT_MAX_WRITE + _ATT_HEADER_SIZE
 
     def _irq(self, event, data):
         if event == _IRQ_SCAN_RESULT:
+            if not self._scanning:
+                return  # another connection scans
             addr_type, addr, adv_type, rssi, adv_data = data
             if adv_type in (_ADV_IND, _ADV_DIRECT_IND) and _HUB_SERVICE_UUID in decode_services(
                 adv_data
@@ -89,6 +248,9 @@ class BLESimpleCentral:
                 self._ble.gap_scan(None)
 
         elif event == _IRQ_SCAN_DONE:
+            if not self._scanning:
+                return
+            self._scanning = False
             if self._scan_callback:
                 if self._addr:
                     # Found a device during the scan (and the scan was explicitly stopped).
@@ -121,6 +283,8 @@ class BLESimpleCentral:
 
         elif event == _IRQ_GATTC_SERVICE_DONE:
             # Service query complete.
+            if data[0] != self._conn_handle:
+                return
             if self._start_handle and self._end_handle:
                 log.info("Discovering characteristics....")
                 self._ble.gattc_discover_characteristics(
@@ -134,27 +298,36 @@ class BLESimpleCentral:
             conn_handle, def_handle, value_handle, properties, uuid = data
             if conn_handle == self._conn_handle and uuid == _HUB_CHAR_UUID:
                 self._char_handle = value_handle
-                log.debug("Get characteristics results: ", value_handle, properties, uuid)
+                if __debug__:
+                    log.debug("Get characteristics results: %s %s %s", value_handle, properties, uuid)
 
         elif event == _IRQ_GATTC_CHARACTERISTIC_DONE:
             # Characteristic query complete.
+            if data[0] != self._conn_handle:
+                return
             if self._char_handle is not None:
+                self._ble.gattc_exchange_mtu(self._conn_handle)
                 # We've finished connecting and discovering device, fire the connect callback.
                 if self._conn_callback:
                     self._conn_callback()
             else:
                 log.warning("Failed to find characteristic.")
 
+        elif event == _IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            if conn_handle == self._conn_handle:
+                self.mtu = mtu
+                log.debug("MTU exchanged: %s", mtu)
+
         elif event == _IRQ_GATTC_WRITE_DONE:
             conn_handle, value_handle, status = data
-            log.debug("TX complete")
+            if __debug__:
+                log.debug("TX complete")
 
         elif event == _IRQ_GATTC_NOTIFY:
             conn_handle, value_handle, notify_data = data
             if conn_handle == self._conn_handle and value_handle == self._char_handle:
-                if self._notify_callback:
-                    notify_data =bytes(notify_data)
-                    self._notify_callback(value_handle, notify_data)
+                self.notifications.put(value_handle, notify_data)  # handled later, out of IRQ
 
         else:
             log.warning("Unexpected IRQ received: %s", event)
@@ -169,6 +342,7 @@ class BLESimpleCentral:
     def scan(self, callback=None):
         self._addr_type = None
         self._addr = None
+        self._scanning = True
         self._scan_callback = callback
         self._ble.gap_scan(2000, 30000, 30000)
 
@@ -201,6 +375,10 @@ class BLESimpleCentral:
     def on_notify(self, callback):
         self._notify_callback = callback
 
+    def _deliver(self, handle, data):
+        if self._notify_callback:
+            self._notify_callback(handle, data)
+
 
 class STM32Connection(Connection):
     def __init__(self, controller=None):
@@ -208,6 +386,7 @@ class STM32Connection(Connection):
         self.ble = bluetooth.BLE()
         self.name = controller
         self._device = BLESimpleCentral(self.ble)
+        self._ready = Event()  # set once services are discovered
 
     def on_scan(self,addr_type, addr, name):
         if addr_type is not None:
@@ -216,25 +395,94 @@ class STM32Connection(Connection):
                 MyMac+=(hex(addr[i])+":")
                 i+=1
             log.info("Found peripheral: %s", MyMac)
-            self._device.connect()
+            self._device.connect(callback=self._ready.set)
         else:
             log.warning("No peripheral found.")
 
     def connect(self, hub_mac=None):
         self._device.scan(callback=self.on_scan)
 
+    def connect_to(self, addr_type, addr):
+        """
+        Connects to the hub found by HubScanner, without scanning again
+        """
+        log.info("Connecting to %s", addr)
+        self._device.connect(addr_type, addr, callback=self._ready.set)
+
     def is_alive(self):
-        self._device.is_connected()
-    
+        return self._device.is_connected()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @property
+    def max_write(self):
+        return self._device.mtu - _ATT_HEADER_SIZE
+
     def disconnect(self):
+        self._ready.clear()
         self._device.disconnect()
     
     def write(self, handle, data):
         self._device.write(handle,data,False)
 
+    def write_many(self, handle, frames):
+        for chunk in pack_frames(frames, self.max_write):
+            self._device.write(handle, chunk, False)
+
     def enable_notifications(self):
         self._device.write(ENABLE_NOTIFICATIONS_HANDLE, ENABLE_NOTIFICATIONS_VALUE,False)
     
     def set_notify_handler(self, handler):
         self._device.on_notify(handler)
-    
\ No newline at end of file
+
+    @property
+    def notifications(self):
+        """
+        :rtype: NotificationRing
+        """
+        return self._device.notifications
+    
+
+
+class HubScanner(object):
+    """
+    Collects every hub advertising during a single scan, to connect several of them afterwards
+    """
+
+    def __init__(self, ble=None):
+        self._ble = ble or bluetooth.BLE()
+        self._ble.active(True)
+        self._found = {}  # addr -> [addr_type, name]
+        self._done = Event()
+
+    def _irq(self, event, data):
+        if event == _IRQ_SCAN_RESULT:
+            addr_type, addr, adv_type, rssi, adv_data = data
+            addr = bytes(addr)  # buffer is owned by caller
+            if adv_type in (_ADV_IND, _ADV_DIRECT_IND) and _HUB_SERVICE_UUID in decode_services(adv_data):
+                if addr not in self._found:
+                    self._found[addr] = [addr_type, decode_name(adv_data) or None]
+            elif adv_type == _ADV_SCAN_RSP and addr in self._found and not self._found[addr][1]:
+                self._found[addr][1] = decode_name(adv_data) or None
+        elif event == _IRQ_SCAN_DONE:
+            self._done.set()
+
+    def scan(self, duration_ms=2000):
+        """
+        :return: list of (addr_type, addr, name) tuples
+        """
+        self._found = {}
+        self._done.clear()
+        _listen_irq(self._ble, self)
+        try:
+            self._ble.gap_scan(duration_ms, 30000, 30000, True)  # active, hubs tell names in scan response
+            self._done.wait()
+        finally:
+            _unlisten_irq(self)
+        return [(addr_type, addr, name) for addr, (addr_type, name) in self._found.items()]
+
+
+def mac2str(addr):
+    return ":".join("%02X" % x for x in addr)
+
@@ -6,7 +6,7 @@ import time
 
 from bleak import BleakClient, discover
 
-from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR
+from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR, DEFAULT_MAX_WRITE, pack_frames
 
 log = logging.getLogger('comms-bleak')
 
@@ -17,6 +17,7 @@ req_queue = queue.Queue()
 
 class BleakDriver(object):
     """Driver that provides interface between API and Bleak."""
+    max_write = DEFAULT_MAX_WRITE
 
     def __init__(self, hub_mac=None, hub_name=None):
         """
@@ -58,13 +59,14 @@ class BleakDriver(object):
     async def _bleak_thread(self):
         bleak = BleakConnection()
         await bleak.connect(self.hub_mac, self.hub_name)
+        self.max_write = bleak.max_write
         await bleak.set_notify_handler(self._safe_handler)
         # After connecting, need to send any data or hub will drop the connection,
         # below command is Advertising name request update
         await bleak.write_char(MOVE_HUB_HW_UUID_CHAR, bytearray([0x05, 0x00, 0x01, 0x01, 0x05]))
         while not self._abort:
             await asyncio.sleep(0.1)
-            if req_queue.qsize() != 0:
+            while req_queue.qsize() != 0:
                 data = req_queue.get()
                 await bleak.write(data[0], data[1])
 
@@ -95,7 +97,19 @@ class BleakDriver(object):
         if not self._connection_thread.is_alive() or not self._processing_thread.is_alive():
             raise ConnectionError('Something went wrong, communication threads not functioning.')
 
-        req_queue.put((handle, data))
+        req_queue.put((handle, bytes(data)))  # data buffer gets reused by the caller
+
+    def write_many(self, handle, frames):
+        """
+        Send several messages packed into as few writes as MTU allows.
+
+        :param handle: Handle number that will be translated into characteristic uuid
+        :param frames: list of messages to send
+        :raises ConnectionError" When internal threads are not working
+        :return: None
+        """
+        for chunk in pack_frames(frames, self.max_write):
+            self.write(handle, chunk)
 
     def disconnect(self):
         """
@@ -127,6 +141,7 @@ class BleakConnection(Connection):
 
         self._device = None
         self._client = None
+        self.max_write = DEFAULT_MAX_WRITE
         logging.getLogger('bleak.backends.dotnet.client').setLevel(logging.WARNING)
         logging.getLogger('bleak.backends.bluezdbus.client').setLevel(logging.WARNING)
 
@@ -160,6 +175,9 @@ class BleakConnection(Connection):
         self._client = BleakClient(self._device.address, self.loop)
         status = await self._client.connect()
         log.debug('Connection status: {status}'.format(status=status))
+        mtu_size = getattr(self._client, 'mtu_size', None)  # not known by older bleak versions
+        if mtu_size:
+            self.max_write = mtu_size - 3
 
     async def write(self, handle, data):
         """
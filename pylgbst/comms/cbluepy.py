@@ -4,7 +4,7 @@ from threading import Thread, Event
 
 from bluepy import btle
 
-from pylgbst.comms import Connection
+from pylgbst.comms import Connection, pack_frames
 from pylgbst.utilities import str2hex, queue
 
 log = logging.getLogger('comms-bluepy')
@@ -71,8 +71,17 @@ class BluepyThreadedPeripheral(object):
             self._peripheral.disconnect()
 
     def write(self, handle, data):
+        data = bytes(data)  # buffer gets reused by the caller before the queued call runs
         self._call_queue.put(lambda: self._peripheral.writeCharacteristic(handle, data))
 
+    def write_many(self, handle, chunks):
+        # a single call, not to wait for notifications between the chunks
+        def write_all():
+            for chunk in chunks:
+                self._peripheral.writeCharacteristic(handle, chunk)
+
+        self._call_queue.put(write_all)
+
     def set_notify_handler(self, handler):
         delegate = BluepyDelegate(handler)
         self._call_queue.put(lambda: self._peripheral.withDelegate(delegate))
@@ -114,6 +123,11 @@ class BluepyConnection(Connection):
         log.debug("Writing to handle %s: %s", handle, str2hex(data))
         self._peripheral.write(handle, data)
 
+    def write_many(self, handle, frames):
+        chunks = pack_frames(frames, self.max_write)
+        log.debug("Writing %s messages to handle %s in %s writes", len(frames), handle, len(chunks))
+        self._peripheral.write_many(handle, chunks)
+
     def set_notify_handler(self, handler):
         self._peripheral.set_notify_handler(handler)
 
@@ -2,7 +2,7 @@ import logging
 
 import pygatt
 
-from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR
+from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR, pack_frames
 from pylgbst.utilities import str2hex
 
 log = logging.getLogger('comms-pygatt')
@@ -50,6 +50,12 @@ class GattoolConnection(Connection):
         log.debug("Writing to handle %s: %s", handle, str2hex(data))
         return self._conn_hnd.char_write_handle(handle, bytearray(data))
 
+    def write_many(self, handle, frames):
+        chunks = pack_frames(frames, self.max_write)
+        log.debug("Writing %s messages to handle %s in %s writes", len(frames), handle, len(chunks))
+        for chunk in chunks:
+            self._conn_hnd.char_write_handle(handle, bytearray(chunk))
+
     def set_notify_handler(self, handler):
         self._conn_hnd.subscribe(MOVE_HUB_HW_UUID_CHAR, handler)
 
@@ -0,0 +1,175 @@
+"""
+Connecting and supervising several hubs as a group.
+
+    fleet = HubFleet(MoveHub)
+    fleet.add(hub_name="Left arm")
+    fleet.add(hub_mac="00:16:53:A1:B2:C3")
+    fleet.connect()
+    fleet.hubs["Left arm"].motor_A.timed(1.0)
+    log.info("%s", fleet.health())
+"""
+import logging
+import traceback
+
+from pylgbst import get_connection_auto
+from pylgbst.hub import Hub, MoveHub
+from pylgbst.utilities import ticks_add, ticks_diff, ticks_ms
+
+try:
+    from threading import Thread
+except ImportError:  # MicroPython on STM32, connections are driven by the shared BLE IRQ handler
+    Thread = None
+
+log = logging.getLogger('fleet')
+
+
+class HubFleet(object):
+    """
+    :type hubs: dict[str,pylgbst.hub.Hub]
+    """
+    SCAN_DURATION = 3  # seconds
+    CONNECT_TIMEOUT = 10  # seconds for each hub to get connected
+
+    def __init__(self, hub_class=MoveHub, **hub_kwargs):
+        """
+        :param hub_kwargs: passed to every hub's constructor, like report_status=False
+        """
+        self.hub_class = hub_class
+        self.hub_kwargs = hub_kwargs
+        self.targets = []  # (key, hub_mac, hub_name)
+        self.hubs = {}
+        self.errors = {}  # key -> why the hub is not in the fleet
+        self._msg_handlers = []
+
+    def add(self, hub_mac=None, hub_name=None):
+        """
+        :return: key of the hub in hubs dict, its MAC or name
+        """
+        assert hub_mac or hub_name, "You have to provide either hub_mac or hub_name"
+        key = hub_mac or hub_name
+        self.targets.append((key, hub_mac, hub_name))
+        return key
+
+    def connect(self, connection_factory=None):
+        """
+        Connects all the added hubs. Hubs that failed get listed in errors.
+
+        :param connection_factory: function(hub_mac, hub_name) returning connection,
+            by default STM32 connections after a single scan, otherwise get_connection_auto in parallel
+        """
+        if connection_factory is None:
+            try:
+                connections = self._connect_stm32()
+            except ImportError:
+                connections = self._run_each(
+                    self.targets, lambda key, mac, name: get_connection_auto(hub_mac=mac, hub_name=name))
+        else:
+            connections = self._run_each(self.targets, lambda key, mac, name: connection_factory(mac, name))
+
+        members = [(key, connections[key]) for key, _, _ in self.targets if key in connections]
+        hubs = self._run_each(members, self._create_hub)
+        self.hubs.update(hubs)
+        for key, hub in hubs.items():
+            for classname, callback in self._msg_handlers:
+                self._add_hub_handler(key, hub, classname, callback)
+
+        log.info("Fleet has %s of %s hubs", len(self.hubs), len(self.targets))
+        return self
+
+    def _connect_stm32(self):
+        from pylgbst.comms.ble_sensor import HubScanner, STM32Connection, mac2str
+
+        found = HubScanner().scan(self.SCAN_DURATION * 1000)
+        log.debug("Found hubs: %s", [(mac2str(addr), name) for _, addr, name in found])
+
+        connections = {}
+        for key, hub_mac, hub_name in self.targets:
+            for addr_type, addr, name in found:
+                if (hub_mac and hub_mac.lower() == mac2str(addr).lower()) or (not hub_mac and hub_name == name):
+                    break
+            else:
+                self.errors[key] = "Not found by scan"
+                continue
+
+            conn = STM32Connection()
+            conn.connect_to(addr_type, addr)
+            # BLE controller takes one connection attempt at a time,
+            # service discovery of this hub goes on while we connect the next one
+            deadline = ticks_add(ticks_ms(), self.CONNECT_TIMEOUT * 1000)
+            while not conn.is_alive() and ticks_diff(deadline, ticks_ms()) > 0:
+                conn.wait_ready(0.01)
+            if conn.is_alive():
+                connections[key] = conn
+            else:
+                self.errors[key] = "Connection timeout"
+        return connections
+
+    def _create_hub(self, key, connection):
+        return self.hub_class(connection, **self.hub_kwargs)
+
+    def _run_each(self, items, func):
+        """
+        Calls func(*item) for every item, in parallel threads where there are threads
+
+        :return: dict of results by item's key, which is item's first element
+        """
+        results = {}
+
+        def run(item):
+            try:
+                results[item[0]] = func(*item)
+            except BaseException:
+                log.warning("Hub %s failed: %s", item[0], traceback.format_exc())
+                self.errors[item[0]] = traceback.format_exc()
+
+        if Thread is None:
+            for item in items:
+                run(item)
+            return results
+
+        threads = [Thread(target=run, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def add_message_handler(self, classname, callback):
+        """
+        Handles given upstream messages from all the hubs, callback gets hub's key and the message
+        """
+        self._msg_handlers.append((classname, callback))
+        for key, hub in self.hubs.items():
+            self._add_hub_handler(key, hub, classname, callback)
+
+    def _add_hub_handler(self, key, hub, classname, callback):
+        hub.add_message_handler(classname, lambda msg: callback(key, msg))
+
+    def health(self):
+        """
+        :return: dict with summary counts and per-hub state, latency stats in milliseconds
+        """
+        hubs = {}
+        alive = ready = 0
+        for key, hub in self.hubs.items():
+            is_alive = bool(hub.connection.is_alive())
+            alive += is_alive
+            ready += hub.state == Hub.STATE_READY
+            hubs[key] = {
+                "alive": is_alive,
+                "state": hub.state,
+                "startup_ms": hub.startup_ms,
+                "pending": hub.pending_count(),
+                "latency": hub.latency.as_dict(),
+            }
+        return {
+            "total": len(self.targets),
+            "alive": alive,
+            "ready": ready,
+            "failed": sorted(self.errors.keys()),
+            "hubs": hubs,
+        }
+
+    def disconnect(self):
+        for hub in self.hubs.values():
+            hub.connection.disconnect()
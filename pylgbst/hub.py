@@ -1,11 +1,12 @@
 import logging
-import time
 
 from pylgbst import get_connection_auto
+from pylgbst.capabilities import CapabilityCache
+from pylgbst.comms import WriteBatcher
 from pylgbst.messages import *
 from pylgbst.peripherals import *
 #from pylgbst.utilities import queue
-from pylgbst.utilities import str2hex, usbyte, ushort
+from pylgbst.utilities import Event, RLock, str2hex, ticks_add, ticks_diff, ticks_ms, usbyte, ushort, usint
 
 log = logging.getLogger('hub')
 
@@ -22,33 +23,166 @@ PERIPHERAL_TYPES = {
 }
 
 
+class ReplyTimeout(RuntimeError):
+    pass
+
+
+class LatencyStats(object):
+    """
+    Running statistics of request round trips, in milliseconds
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.min = None
+        self.max = None
+        self.total = 0
+
+    def add(self, millis):
+        self.count += 1
+        self.last = millis
+        self.total += millis
+        if self.min is None or millis < self.min:
+            self.min = millis
+        if self.max is None or millis > self.max:
+            self.max = millis
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        return {"count": self.count, "last": self.last, "min": self.min, "max": self.max, "mean": self.mean()}
+
+
+class PendingReply(object):
+    """
+    Request sent to the hub that still awaits its reply
+
+    :type request: pylgbst.messages.DownstreamMsg
+    :type reply: pylgbst.messages.UpstreamMsg
+    """
+
+    def __init__(self, hub, request, seq):
+        self.hub = hub
+        self.request = request
+        self.seq = seq  # to tell which of the requests was sent first
+        self.reply = None
+        self.accepted = False
+        self.sent = ticks_ms()
+        self._event = Event()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.request)
+
+    def is_done(self):
+        return self.reply is not None
+
+    def set_reply(self, msg):
+        self.reply = msg
+        if not self.accepted:
+            self.hub.latency.add(ticks_diff(ticks_ms(), self.sent))
+        self._event.set()
+
+    def accept(self):
+        if not self.accepted:
+            self.accepted = True
+            # long-running commands are timed till the hub takes them, not till they complete
+            self.hub.latency.add(ticks_diff(ticks_ms(), self.sent))
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait for the reply, hub's REPLY_TIMEOUT by default.
+            Output commands accepted by the hub are waited for until completed.
+        :rtype: pylgbst.messages.UpstreamMsg
+        """
+        if timeout is None:
+            timeout = self.hub.REPLY_TIMEOUT
+
+        self.hub.flush()  # request might still sit in the write batch
+        if not self._event.wait(timeout):
+            self._timed_out(timeout)
+            # hub is executing the command, it takes as long as it takes
+            self._event.wait()
+
+        log.debug("Fetched sync reply: %r", self.reply)
+        return self._result()
+
+    def _timed_out(self, timeout):
+        if not self.accepted:
+            self.hub._forget_pending(self)
+            raise ReplyTimeout("No reply to %r within %ss" % (self.request, timeout))
+
+    def _result(self):
+        if isinstance(self.reply, MsgGenericError):
+            raise RuntimeError(self.reply.message())
+        return self.reply
+
+
 class Hub(object):
     """
     :type connection: pylgbst.comms.Connection
     :type peripherals: dict[int,Peripheral]
     """
     HUB_HARDWARE_HANDLE = 0x0E
+    DEFAULT_NAME = None
+    REPLY_TIMEOUT = 10  # seconds to wait for the hub to react on request
+    CONNECT_TIMEOUT = 10  # seconds to wait for connection to become ready
+    # file to remember port modes of known devices, None for memory only
+    CAPABILITY_CACHE = CapabilityCache.DEFAULT_FILENAME
+
+    # start-up states
+    STATE_CONNECTING = 0
+    STATE_CONNECTED = 1  # notifications are enabled
+    STATE_READY = 2  # expected devices are attached
+    PERIPHERAL_TYPES = PERIPHERAL_TYPES
+    DEFAULT_PERIPHERAL = GenericPeripheral
+    PENDING_REPLY_CLASS = PendingReply
 
     def __init__(self, connection=None):
-        self._msg_handlers = []
+        self._started = ticks_ms()
+        self.state = self.STATE_CONNECTING
+        self.startup_ms = None  # time it took from constructor to ready state
+        self._devices_changed = Event()
+        self._msg_handlers = {}  # upstream message class -> list of handlers, see add_message_handler
         self.peripherals = {}
-        self._sync_request = None
-        self._sync_replies = None
+        self._comm_lock = RLock()
+        self._pending = {}  # reply key -> list of PendingReply, oldest first
+        self._pending_seq = 0
+        self._batcher = None
+        self._frames = FrameSplitter()
+        self._msg_pool = MsgPool()
+        self.latency = LatencyStats()
+        self.capabilities = CapabilityCache.shared(self.CAPABILITY_CACHE)  # one per file for all the hubs
 
         self.add_message_handler(MsgHubAttachedIO, self._handle_device_change)
         self.add_message_handler(MsgPortValueSingle, self._handle_sensor_data)
         self.add_message_handler(MsgPortValueCombined, self._handle_sensor_data)
+        self.add_message_handler(MsgPortOutputFeedback, self._handle_output_feedback)
         self.add_message_handler(MsgGenericError, self._handle_error)
         self.add_message_handler(MsgHubAction, self._handle_action)
 
         if not connection:
-            connection = get_connection_auto()  # TODO: how to identify the hub?
+            connection = get_connection_auto(hub_name=self.DEFAULT_NAME)  # TODO: how to identify the hub?
         self.connection = connection
         self.connection.set_notify_handler(self._notify)
-        #if self.connection.is_alive() == False:
-        #print("Wait for 2 seconds!")
-        time.sleep(2) # WORKAROUND
+        self._start()
+
+    def _start(self):
+        self._connect()
+        self._set_ready()
+
+    def _connect(self):
+        if not self.connection.wait_ready(self.CONNECT_TIMEOUT):
+            raise RuntimeError("Connection is not ready within %ss" % self.CONNECT_TIMEOUT)
+        self._frames.reset()  # nothing left of a message from previous connection
         self.connection.enable_notifications()
+        self.state = self.STATE_CONNECTED
+
+    def _set_ready(self):
+        self.state = self.STATE_READY
+        self.startup_ms = ticks_diff(ticks_ms(), self._started)
+        log.info("Hub is ready in %sms", self.startup_ms)
 
     def __del__(self):
         if self.connection and self.connection.is_alive():
@@ -56,64 +190,188 @@ class Hub(object):
             self.connection.disconnect()
 
     def add_message_handler(self, classname, callback):
-        self._msg_handlers.append((classname, callback))
+        # index the handler under every concrete upstream class it accepts,
+        # so dispatch in _notify is a single dict lookup
+        for msg_kind in UPSTREAM_MSGS:
+            if issubclass(msg_kind, classname):
+                if msg_kind not in self._msg_handlers:
+                    self._msg_handlers[msg_kind] = []
+                self._msg_handlers[msg_kind].append(callback)
 
-    def send(self, msg):
+    def send(self, msg, timeout=None):
         """
         :type msg: pylgbst.messages.DownstreamMsg
+        :param timeout: seconds to wait for the reply, see PendingReply.wait
         :rtype: pylgbst.messages.UpstreamMsg
         """
-        log.debug("Send message: %r", msg)
+        pending = self.request(msg)
+        if pending is None:
+            self.flush()
+            return None
+        return pending.wait(timeout)
+
+    def send_all(self, msgs, timeout=None):
+        """
+        Sends all the messages before waiting for any reply, so their round trips overlap
+
+        :rtype: list[pylgbst.messages.UpstreamMsg]
+        """
+        pendings = [self.request(msg) for msg in msgs]
+        self.flush()
+        return [pending.wait(timeout) if pending else None for pending in pendings]
+
+    def wait_all(self, pendings, timeout=None):
+        """
+        Waits for several requests sent without waiting, like motor commands with wait=False
+
+        :type pendings: list[PendingReply]
+        :param timeout: seconds to wait for all of them, see PendingReply.wait
+        :rtype: list[pylgbst.messages.UpstreamMsg]
+        """
+        self.flush()
+        if timeout is None:
+            return [pending.wait() if pending else None for pending in pendings]
+
+        deadline = ticks_add(ticks_ms(), int(timeout * 1000))
+        replies = []
+        for pending in pendings:
+            left = max(0, ticks_diff(deadline, ticks_ms()))
+            replies.append(pending.wait(left / 1000.0) if pending else None)
+        return replies
+
+    def request(self, msg):
+        """
+        Sends message without waiting for the reply
+
+        :type msg: pylgbst.messages.DownstreamMsg
+        :rtype: PendingReply
+        :return: None if message needs no reply
+        """
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("Send message: %r", msg)
         msgbytes = msg.bytes()
+        pending = None
         if msg.needs_reply == True:
-            self._sync_request = msg
-            self.connection.write(self.HUB_HARDWARE_HANDLE, msgbytes)
-
-            while self._sync_replies == None:
-                time.sleep(0.1)
-            resp = self._sync_replies
-            log.debug("Fetched sync reply: %r", resp)
-            self._sync_replies = None;
-            if isinstance(resp, MsgGenericError):
-                raise RuntimeError(resp.message())
-            return resp
+            # registered before writing, the reply may come back before write() returns
+            with self._comm_lock:
+                self._pending_seq += 1
+                pending = self.PENDING_REPLY_CLASS(self, msg, self._pending_seq)
+                key = msg.reply_key()
+                if key not in self._pending:
+                    self._pending[key] = []
+                self._pending[key].append(pending)
+        if self._batcher:
+            with self._comm_lock:
+                self._batcher.add(msgbytes)
+                if pending is None and self._batcher.holds_back():
+                    self._batcher.flush()  # nobody waits for a reply to flush it, nor does the budget timer
         else:
             self.connection.write(self.HUB_HARDWARE_HANDLE, msgbytes)
-            return None
+        return pending
+
+    def enable_batching(self, max_size=None, budget_ms=WriteBatcher.BUDGET_MS):
+        """
+        Makes messages sent without waiting for reply share BLE writes, see WriteBatcher.
+        Waiting for any reply flushes the batch, so does a timer once the oldest message has waited budget_ms.
+
+        :param max_size: bytes per write, connection's max_write by default
+        :param budget_ms: longest time a message is held back
+        """
+        self._batcher = WriteBatcher(self.connection, self.HUB_HARDWARE_HANDLE, max_size, budget_ms, self._comm_lock)
+
+    def disable_batching(self):
+        self.flush()
+        self._batcher = None
+
+    def flush(self):
+        """
+        Writes out the messages collected by batching
+        """
+        if self._batcher:
+            with self._comm_lock:
+                self._batcher.flush()
+
+    def pending_count(self):
+        return sum(len(waiting) for waiting in self._pending.values())
+
+    def _forget_pending(self, pending):
+        with self._comm_lock:
+            key = pending.request.reply_key()
+            waiting = self._pending.get(key, ())
+            if pending in waiting:
+                waiting.remove(pending)
+                if not waiting:
+                    del self._pending[key]
 
     def _notify(self, handle, data):
-        log.debug("Notification on %s: %s", handle, str2hex(data))
-        
-        msg = self._get_upstream_msg(data)
-
-        if self._sync_request:
-            if self._sync_request.is_reply(msg):
-                log.debug("Found matching upstream msg: %r", msg)
-                self._sync_replies = msg
-                self._sync_request = None
-
-        for msg_class, handler in self._msg_handlers:
-            if isinstance(msg, msg_class):
+        # without threads it may interrupt the caller in the middle of request bookkeeping, see RLock
+        self._comm_lock.run_exclusive(self._handle_notification, handle, data)
+
+    def _handle_notification(self, handle, data):
+        # runs for every notification: no formatting unless debugging, nothing at all when built with -O
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("Notification on %s: %s", handle, str2hex(data))
+
+        for frame in self._frames.feed(data):
+            msg = self._get_upstream_msg(frame)
+
+            parts = msg.split()
+            if parts:
+                for part in parts:
+                    self._dispatch(part)
+            else:
+                self._dispatch(msg)
+            self._msg_pool.release(msg)
+
+    def _dispatch(self, msg):
+        key = msg.reply_key()
+        if key in self._pending:
+            self._resolve_pending(key, msg)
+
+        for handler in self._msg_handlers.get(type(msg), ()):
+            if __debug__ and log.isEnabledFor(logging.DEBUG):
                 log.debug("Handling msg with %s: %r", handler, msg)
-                handler(msg)
+            handler(msg)
 
     def _get_upstream_msg(self, data):
-        msg_type = usbyte(data, 2)
-        #print("Message Type: ",msg_type)
-        msg = None
-        for msg_kind in UPSTREAM_MSGS:
-            if msg_type == msg_kind.TYPE:
-                msg = msg_kind.decode(msg_kind,data)
-                log.debug("Decoded message: %r", msg)
-                break
-        assert msg
+        msg_type = data[decode_length(data)[1] + 1]  # after length and hub id
+        msg_kind = UPSTREAM_MSGS_BY_TYPE.get(msg_type)
+        assert msg_kind, "Unknown upstream message type: %x" % msg_type
+        msg = self._msg_pool.decode(msg_kind, data)
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("Decoded message: %r", msg)
         return msg
 
+    def _resolve_pending(self, key, msg):
+        with self._comm_lock:
+            for pending in self._pending.get(key, ()):
+                if pending.request.is_reply(msg):
+                    self._forget_pending(pending)
+                    break
+                if pending.request.is_accepted(msg):
+                    pending.accept()
+                    return
+            else:
+                return
+
+        log.debug("Found matching upstream msg: %r", msg)
+        if self._msg_pool.is_pooled(msg):
+            msg = msg.copy()  # reply outlives dispatch
+        pending.set_reply(msg)
+
     def _handle_error(self, msg):
         log.warning("Command error: %s", msg.message())
-        if self._sync_request:
-            self._sync_request = None
-            self._sync_replies = msg
+        # error tells only the type of failed command, blame the oldest one of that type
+        with self._comm_lock:
+            failed = None
+            for waiting in self._pending.values():
+                for pending in waiting:
+                    if pending.request.TYPE == msg.cmd and (failed is None or pending.seq < failed.seq):
+                        failed = pending
+            if failed is None:
+                return
+            self._forget_pending(failed)
+        failed.set_reply(msg)
 
     def _handle_action(self, msg):
         """
@@ -136,35 +394,42 @@ class Hub(object):
         port = msg.port
         dev_type = ushort(msg.payload, 0)
 
-        if dev_type in PERIPHERAL_TYPES:
-            self.peripherals[port] = PERIPHERAL_TYPES[dev_type](self, port)
+        if dev_type in self.PERIPHERAL_TYPES:
+            self.peripherals[port] = self.PERIPHERAL_TYPES[dev_type](self, port)
         else:
             log.warning("Have not dedicated class for peripheral type %x on port %x", dev_type, port)
-            self.peripherals[port] = Peripheral(self, port)
+            self.peripherals[port] = self.DEFAULT_PERIPHERAL(self, port)
 
         log.info("Attached peripheral: %s", self.peripherals[msg.port])
 
+        self.peripherals[port].dev_type = dev_type
         if msg.event == msg.EVENT_ATTACHED:
-            hw_revision = reversed([usbyte(msg.payload, x) for x in range(2, 6)])
-            sw_revision = reversed([usbyte(msg.payload, x) for x in range(6, 10)])
-            # what to do with this info? it's useless, I guess
-            del hw_revision, sw_revision
+            # identifies the device for capability cache
+            self.peripherals[port].hw_revision = usint(msg.payload, 2)
+            self.peripherals[port].sw_revision = usint(msg.payload, 6)
         elif msg.event == msg.EVENT_ATTACHED_VIRTUAL:
             self.peripherals[port].virtual_ports = (usbyte(msg.payload, 2), usbyte(msg.payload, 3))
 
+        self._devices_changed.set()
+
     def _handle_sensor_data(self, msg):
         assert isinstance(msg, (MsgPortValueSingle, MsgPortValueCombined))
-        if msg.port not in self.peripherals:
+        device = self.peripherals.get(msg.port)
+        if device is None:
             log.warning("Notification on port with no device: %s", msg.port)
             return
-        device = self.peripherals[msg.port]
         device.queue_port_data(msg)
 
+    def _handle_output_feedback(self, msg):
+        device = self.peripherals.get(msg.port)
+        if device is not None:
+            device.queue_output_feedback(msg)
+
     def disconnect(self):
-        self.send(MsgHubAction(MsgHubAction.DISCONNECT))
+        return self.send(MsgHubAction(MsgHubAction.DISCONNECT))
 
     def switch_off(self):
-        self.send(MsgHubAction(MsgHubAction.SWITCH_OFF))
+        return self.send(MsgHubAction(MsgHubAction.SWITCH_OFF))
 
 
 class MoveHub(Hub):
@@ -186,6 +451,7 @@ class MoveHub(Hub):
     """
 
     DEFAULT_NAME = "LEGO Move Hub"
+    BUTTON_CLASS = Button
 
     # PORTS
     PORT_A = 0x00
@@ -199,16 +465,15 @@ class MoveHub(Hub):
     PORT_VOLTAGE = 0x3C
 
     # noinspection PyTypeChecker
-    def __init__(self, connection=None):
-        self._comm_lock = None #threading.RLock()
-        if connection is None:
-            connection = get_connection_auto(hub_name=self.DEFAULT_NAME)
-
-        super(MoveHub, self).__init__(connection)
+    def __init__(self, connection=None, report_status=True):
+        """
+        :param report_status: log hub's name, MAC and battery state on start
+        """
         self.info = {}
+        self.report_status = report_status
 
-        # shorthand fields
-        self.button = Button(self)
+        # shorthand fields, set before connecting as devices get attached right away
+        self.button = None
         self.led = None
         self.current = None
         self.voltage = None
@@ -221,75 +486,96 @@ class MoveHub(Hub):
         self.port_C = None
         self.port_D = None
 
+        super(MoveHub, self).__init__(connection)
+        self.button = self.BUTTON_CLASS(self)
+
+    def _start(self):
+        self._connect()
+        # status round trips overlap with builtin devices getting attached
+        pendings = [self.request(msg) for msg in self._status_requests()] if self.report_status else ()
         self._wait_for_devices()
-        self._report_status()
+        self._set_ready()
+        if pendings:
+            self._log_status([pending.wait() for pending in pendings])
+
+    def _builtin_devices(self):
+        return (self.motor_A, self.motor_B, self.motor_AB, self.led, self.tilt_sensor,
+                self.current, self.voltage)
 
-    def _wait_for_devices(self, get_dev_set=None):
+    def _wait_for_devices(self, get_dev_set=None, timeout=10):
         if not get_dev_set:
-            get_dev_set = lambda: (self.motor_A, self.motor_B, self.motor_AB, self.led, self.tilt_sensor,
-                                   self.current, self.voltage)
-        for num in range(0, 100):
+            get_dev_set = self._builtin_devices
+        deadline = ticks_add(ticks_ms(), timeout * 1000)
+        while True:
+            self._devices_changed.clear()  # before the check, not to miss a device attached meanwhile
             devices = get_dev_set()
             if all(devices):
                 log.debug("All devices are present: %s", devices)
-                return
+                return True
+            left = ticks_diff(deadline, ticks_ms())
+            if left <= 0:
+                break
             log.debug("Waiting for builtin devices to appear: %s", devices)
-            time.sleep(0.1)
+            self._devices_changed.wait(left / 1000.0)
         log.warning("Got only these devices: %s", get_dev_set())
+        return False
 
     def _report_status(self):
+        self._log_status(self.send_all(self._status_requests()))
+
+    def _status_requests(self):
         # maybe add firmware version
-        name = self.send(MsgHubProperties(MsgHubProperties.ADVERTISE_NAME, MsgHubProperties.UPD_REQUEST))
-        mac = self.send(MsgHubProperties(MsgHubProperties.PRIMARY_MAC, MsgHubProperties.UPD_REQUEST))
-        log.info("%s on %s", name.payload, str2hex(mac.payload))
+        return (
+            MsgHubProperties(MsgHubProperties.ADVERTISE_NAME, MsgHubProperties.UPD_REQUEST),
+            MsgHubProperties(MsgHubProperties.PRIMARY_MAC, MsgHubProperties.UPD_REQUEST),
+            MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST),
+            MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST),
+        )
+
+    def _log_status(self, replies):
+        name, mac, voltage, alert = replies
+        log.info("%s on %s", bytes(name.parameters), str2hex(mac.parameters))
 
-        voltage = self.send(MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST))
         assert isinstance(voltage, MsgHubProperties)
         log.info("Voltage: %s%%", usbyte(voltage.parameters, 0))
 
-        voltage = self.send(MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST))
-        
-        assert isinstance(voltage, MsgHubAlert)
-        if voltage != None:
-            if not voltage.is_ok():
-                log.warning("Low voltage, check power source (maybe replace battery)")
+        assert isinstance(alert, MsgHubAlert)
+        if not alert.is_ok():
+            log.warning("Low voltage, check power source (maybe replace battery)")
 
     # noinspection PyTypeChecker
     def _handle_device_change(self, msg):
-        if self._comm_lock == None:
-            super(MoveHub, self)._handle_device_change(msg)
-            if isinstance(msg, MsgHubAttachedIO) and msg.event != MsgHubAttachedIO.EVENT_DETACHED:
-                port = msg.port
-                if port == self.PORT_A:
-                    self.motor_A = self.peripherals[port]
-                elif port == self.PORT_B:
-                    self.motor_B = self.peripherals[port]
-                elif port == self.PORT_AB:
-                    self.motor_AB = self.peripherals[port]
-                elif port == self.PORT_C:
-                    self.port_C = self.peripherals[port]
-                elif port == self.PORT_D:
-                    self.port_D = self.peripherals[port]
-                elif port == self.PORT_LED:
-                    self.led = self.peripherals[port]
-                elif port == self.PORT_TILT_SENSOR:
-                    self.tilt_sensor = self.peripherals[port]
-                elif port == self.PORT_CURRENT:
-                    self.current = self.peripherals[port]
-                elif port == self.PORT_VOLTAGE:
-                    self.voltage = self.peripherals[port]
-
-                if type(self.peripherals[port]) == VisionSensor:
-                    self.vision_sensor = self.peripherals[port]
-                elif type(self.peripherals[port]) == EncodedMotor \
-                        and port not in (self.PORT_A, self.PORT_B, self.PORT_AB):
-                    self.motor_external = self.peripherals[port]
+        super(MoveHub, self)._handle_device_change(msg)
+        if isinstance(msg, MsgHubAttachedIO) and msg.event != MsgHubAttachedIO.EVENT_DETACHED:
+            port = msg.port
+            if port == self.PORT_A:
+                self.motor_A = self.peripherals[port]
+            elif port == self.PORT_B:
+                self.motor_B = self.peripherals[port]
+            elif port == self.PORT_AB:
+                self.motor_AB = self.peripherals[port]
+            elif port == self.PORT_C:
+                self.port_C = self.peripherals[port]
+            elif port == self.PORT_D:
+                self.port_D = self.peripherals[port]
+            elif port == self.PORT_LED:
+                self.led = self.peripherals[port]
+            elif port == self.PORT_TILT_SENSOR:
+                self.tilt_sensor = self.peripherals[port]
+            elif port == self.PORT_CURRENT:
+                self.current = self.peripherals[port]
+            elif port == self.PORT_VOLTAGE:
+                self.voltage = self.peripherals[port]
+
+            if isinstance(self.peripherals[port], VisionSensor):
+                self.vision_sensor = self.peripherals[port]
+            elif isinstance(self.peripherals[port], EncodedMotor) \
+                    and port not in (self.PORT_A, self.PORT_B, self.PORT_AB):
+                self.motor_external = self.peripherals[port]
 
 
 class TrainHub(Hub):
     DEFAULT_NAME = 'TrainHub'
 
     def __init__(self, connection=None):
-        if connection is None:
-            connection = get_connection_auto(hub_name=self.DEFAULT_NAME)
         super(TrainHub, self).__init__(connection)
@@ -1,36 +1,87 @@
 #import logging
-from ustruct import pack, unpack
+from ustruct import calcsize, pack_into, unpack_from
 
+from pylgbst.codec import MAX_SHORT_LEN, compile_codec, decode_length, frame
 from pylgbst.utilities import str2hex
 
 #log = logging.getLogger('hub')
 
 
 class Message(object):
+    """
+    Hot message classes declare __slots__ to keep off per-instance dicts where the runtime honours them,
+    fields of both message directions live in this base not to conflict in MsgHubProperties and alike.
+
+    Fields on the wire are declared in FIELDS, encoding and decoding are generated from it, see pylgbst.codec
+    """
     TYPE = None
+    FIELDS = ()
+
+    __slots__ = ('hub_id', 'payload', 'needs_reply', '_data', '_pos')
+
+    _decode_tail = None  # method reading the rest of payload after FIELDS
+    _encode_tail = None  # method returning bytes to follow FIELDS
 
     def __init__(self):
         self.hub_id = 0x00  # not used according to official doc
         self.payload = b""
 
     def bytes(self):
+        return self._encode()
+
+    def _encode(self):
+        return frame(self.hub_id, self.TYPE, self.payload)
+
+    def reply_key(self):
         """
-        see https://lego.github.io/lego-ble-wireless-protocol-docs/#common-message-header
+        Correlation key shared by a request and the upstream messages answering it,
+        first item is the request's TYPE. None means there is nothing to correlate.
         """
-        msglen = len(self.payload) + 3
-        assert msglen < 127, "TODO: handle longer messages with 2-byte len"
-        return pack("<B", msglen) + pack("<B", self.hub_id) + pack("<B", self.TYPE) + self.payload
+        return None
 
     def __repr__(self):
         # assert self.bytes()  # to trigger any field changes
-        data = self.__dict__
-        data = {x: (str2hex(y) if isinstance(y, bytes) else y)
-                for x, y in data.items()
-                if x not in ('hub_id',)}
+        data = {x: (str2hex(y) if isinstance(y, (bytes, memoryview)) else y)
+                for x, y in self._fields()
+                if x not in ('hub_id',) and not x.startswith('_')}
+        data['payload'] = str2hex(self.payload)
         return self.__class__.__name__ + "(%s)" % data
 
+    def _fields(self):
+        """
+        :return: list of (name, value) of instance attributes, kept in __dict__ or in __slots__
+        """
+        fields = list(getattr(self, '__dict__', {}).items())
+        for cls in getattr(type(self), '__mro__', ()):  # MicroPython has no __mro__, nor __slots__
+            for name in getattr(cls, '__slots__', ()):
+                if name != 'payload' and hasattr(self, name):
+                    fields.append((name, getattr(self, name)))
+        return fields
+
+
+class MsgLayout(object):
+    """
+    Precomputed struct layout of a whole message, header included, with a buffer of its own to pack into.
+    Packed data stays valid until the next pack(), writers that keep it for later have to copy it.
+    """
+    __slots__ = ('fmt', 'size', 'buf')
+
+    def __init__(self, fmt):
+        """
+        :param fmt: struct format of message after its header
+        """
+        self.fmt = "<BBB" + fmt
+        self.size = calcsize(self.fmt)
+        assert self.size <= MAX_SHORT_LEN, "Layouts are for messages with 1-byte length"
+        self.buf = bytearray(self.size)
+
+    def pack(self, hub_id, msg_type, *values):
+        pack_into(self.fmt, self.buf, 0, self.size, hub_id, msg_type, *values)
+        return self.buf
+
 
 class DownstreamMsg(Message):
+    __slots__ = ()
 
     def __init__(self):
         super(DownstreamMsg, self).__init__()
@@ -40,44 +91,89 @@ class DownstreamMsg(Message):
         del msg
         return False
 
+    def is_accepted(self, msg):
+        """
+        Tells if msg acknowledges this request without being the final reply,
+        used to lift reply deadline for long-running commands
+        """
+        del msg
+        return False
+
 
 class UpstreamMsg(Message):
+    """
+    Decoded fields are read in place from the received frame, with a cursor moving over it,
+    payload is a view of what is left after the cursor
+    """
+    __slots__ = ()
 
     def __init__(self):
         super(UpstreamMsg, self).__init__()
 
-    #@classmethod
-    def decode(cls, data):
+    @property
+    def payload(self):
+        if not self._pos:
+            return self._data
+        return self._data[self._pos:]
+
+    @payload.setter
+    def payload(self, value):
+        self._data = value
+        self._pos = 0
+
+    # decode(cls, data, msg=None) is generated from FIELDS by compile_codec(),
+    # called as msg_kind.decode(msg_kind, data), msg is an instance to decode into instead of a new one
+
+    def copy(self):
         """
-        see https://lego.github.io/lego-ble-wireless-protocol-docs/#common-message-header
+        Message owned by the caller, with a frame of its own.
+        Messages coming from MsgPool are reused once dispatched, whoever keeps one for later needs a copy.
+
+        :rtype: UpstreamMsg
+        """
+        clone = type(self)()
+        for name, val in self._fields():
+            setattr(clone, name, val)
+        clone.payload = bytes(self._data)
+        clone._pos = self._pos
+        return clone
+
+    def split(self):
+        """
+        Messages reporting on several ports at once give a message per port here
+
+        :rtype: list[UpstreamMsg]
+        :return: None if message is about one port only
         """
-        msg = cls()
-        msg.payload = data
-        msglen = msg._byte()
-        assert msglen < 127, "TODO: handle longer messages with 2-byte len"
-        hub_id = msg._byte()
-        assert hub_id == 0
-        msg_type = msg._byte()
-        assert cls.TYPE == msg_type, "Message type does not match: %x!=%x" % (cls.TYPE, msg_type)
-        #assert isinstance(msg.payload, (bytes, bytearray))
-        return msg
-
-    def __shift(self, vtype, vlen):
-        val = self.payload[0:vlen]
-        self.payload = self.payload[vlen:]
-        return unpack("<" + vtype, val)[0]
+        return None
+
+    def _remaining(self):
+        return len(self._data) - self._pos
+
+    def _unpack(self, fmt, size):
+        val = unpack_from(fmt, self._data, self._pos)[0]
+        self._pos += size
+        return val
 
     def _byte(self):
-        return self.__shift("B", 1)
+        return self._unpack("<B", 1)
 
     def _short(self):
-        return self.__shift("H", 2)
+        return self._unpack("<H", 2)
 
     def _long(self):
-        return self.__shift("I", 4)
+        return self._unpack("<I", 4)
 
     def _float(self):
-        return self.__shift("f", 4)
+        return self._unpack("<f", 4)
+
+    def _string(self):
+        """
+        Zero-terminated string at cursor, the rest of payload if there is no terminator
+        """
+        data = bytes(self.payload)
+        end = data.find(b"\00")
+        return data[:end if end >= 0 else len(data)].decode('ascii')
 
     def _bits_list(self, val):
         res = []
@@ -118,6 +214,8 @@ class MsgHubProperties(DownstreamMsg, UpstreamMsg):
     UPD_REQUEST = 0x05
     UPSTREAM_UPDATE = 0x06
 
+    FIELDS = (("property", "B"), ("operation", "B"))  # parameters follow
+
     def __init__(self, prop=None, operation=None, parameters=b""):
         super(MsgHubProperties, self).__init__()
 
@@ -128,22 +226,21 @@ class MsgHubProperties(DownstreamMsg, UpstreamMsg):
     def bytes(self):
         if self.operation in (self.UPD_REQUEST, self.UPD_ENABLE):
             self.needs_reply = True
-        self.payload = pack("<B", self.property) + pack("<B", self.operation) + self.parameters
         return super(MsgHubProperties, self).bytes()
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgHubProperties, cls).decode(data)
-        assert isinstance(msg, MsgHubProperties)
-        msg.property = msg._byte()
-        msg.operation = msg._byte()
-        msg.parameters = msg.payload
-        return msg
+    def _encode_tail(self):
+        return self.parameters
+
+    def _decode_tail(self):
+        self.parameters = self.payload
 
     def is_reply(self, msg):
         return isinstance(msg, MsgHubProperties) \
                and msg.operation == self.UPSTREAM_UPDATE and msg.property == self.property
 
+    def reply_key(self):
+        return self.TYPE, self.property
+
 
 class MsgHubAction(DownstreamMsg, UpstreamMsg):
     """
@@ -163,12 +260,13 @@ class MsgHubAction(DownstreamMsg, UpstreamMsg):
     UPSTREAM_DISCONNECT = 0x31
     UPSTREAM_BOOT_MODE = 0x32
 
+    FIELDS = (("action", "B"),)
+
     def __init__(self, action=None):
         super(MsgHubAction, self).__init__()
         self.action = action
 
     def bytes(self):
-        self.payload = pack("<B", self.action)
         self.needs_reply = self.action in (self.DISCONNECT, self.SWITCH_OFF)
         return super(MsgHubAction, self).bytes()
 
@@ -181,12 +279,13 @@ class MsgHubAction(DownstreamMsg, UpstreamMsg):
         if self.action == self.SWITCH_OFF and msg.action == self.UPSTREAM_SHUTDOWN:
             return True
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgHubAction, cls).decode(data)
-        assert isinstance(msg, MsgHubAction)
-        msg.action = msg._byte()
-        return msg
+    def reply_key(self):
+        # requests are keyed by the upstream action they expect
+        if self.action == self.DISCONNECT:
+            return self.TYPE, self.UPSTREAM_DISCONNECT
+        if self.action == self.SWITCH_OFF:
+            return self.TYPE, self.UPSTREAM_SHUTDOWN
+        return self.TYPE, self.action
 
 
 class MsgHubAlert(DownstreamMsg, UpstreamMsg):
@@ -200,18 +299,21 @@ class MsgHubAlert(DownstreamMsg, UpstreamMsg):
     LOW_SIGNAL = 0x03
     OVER_POWER = 0x04
 
-    DESCR = {
-        LOW_VOLTAGE: "low voltage",
-        HIGH_CURRENT: "high current",
-        LOW_SIGNAL: "low signal",
-        OVER_POWER: "over power"
-    }
+    DESCR = (  # by alert type
+        None,
+        "low voltage",
+        "high current",
+        "low signal",
+        "over power",
+    )
 
     UPD_ENABLE = 0x01
     UPD_DISABLE = 0x02
     UPD_REQUEST = 0x03
     UPSTREAM_UPDATE = 0x04
 
+    FIELDS = (("atype", "B"), ("operation", "B"), ("status", "B", "remaining"))  # status comes from the hub only
+
     def __init__(self, atype=None, operation=None):
         super(MsgHubAlert, self).__init__()
         self.atype = atype
@@ -219,21 +321,12 @@ class MsgHubAlert(DownstreamMsg, UpstreamMsg):
         self.status = None
 
     def bytes(self):
-        self.payload = pack("<B", self.atype) + pack("<B", self.operation)
         if self.operation == self.UPD_REQUEST:
             self.needs_reply = True
         return super(MsgHubAlert, self).bytes()
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgHubAlert, cls).decode(data)
-        assert isinstance(msg, MsgHubAlert)
-        msg.atype = msg._byte()
-        msg.operation = msg._byte()
-        msg.status = msg._byte()
-
-        assert msg.operation == cls.UPSTREAM_UPDATE
-        return msg
+    def _decode_tail(self):
+        assert self.operation == self.UPSTREAM_UPDATE
 
     def is_ok(self):
         return not self.status
@@ -242,6 +335,9 @@ class MsgHubAlert(DownstreamMsg, UpstreamMsg):
         return isinstance(msg, MsgHubAlert) \
                and msg.operation == self.UPSTREAM_UPDATE and msg.atype == self.atype
 
+    def reply_key(self):
+        return self.TYPE, self.atype
+
 
 class MsgHubAttachedIO(UpstreamMsg):
     """
@@ -269,19 +365,13 @@ class MsgHubAttachedIO(UpstreamMsg):
     DEV_MOTOR_INTERNAL_TACHO = 0x0027
     DEV_TILT_INTERNAL = 0x0028
 
+    FIELDS = (("port", "B"), ("event", "B"))  # the rest depends on event, read by Hub
+
     def __init__(self):
         super(MsgHubAttachedIO, self).__init__()
         self.port = None
         self.event = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgHubAttachedIO, cls).decode(data)
-        assert isinstance(msg, MsgHubAttachedIO)
-        msg.port = msg._byte()
-        msg.event = msg._byte()
-        return msg
-
 
 class MsgGenericError(UpstreamMsg):
     """
@@ -298,32 +388,28 @@ class MsgGenericError(UpstreamMsg):
     ERR_OVERCURRENT = 0x07
     ERR_INTERNAL = 0x08
 
-    DESCR = {
-        ERR_ACK: "ACK",
-        ERR_MACK: "MACK",
-        ERR_BUFFER_OVERFLOW: "Buffer Overflow",
-        ERR_TIMEOUT: "Timeout",
-        ERR_WRONG_COMMAND: "Command NOT recognized",
-        ERR_WRONG_PARAMS: "Invalid use (e.g. parameter error(s)",
-        ERR_OVERCURRENT: "Overcurrent",
-        ERR_INTERNAL: "Internal ERROR",
-    }
+    DESCR = (  # by error code
+        None,
+        "ACK",
+        "MACK",
+        "Buffer Overflow",
+        "Timeout",
+        "Command NOT recognized",
+        "Invalid use (e.g. parameter error(s)",
+        "Overcurrent",
+        "Internal ERROR",
+    )
+
+    FIELDS = (("cmd", "B"), ("err", "B"))
 
     def __init__(self):
         super(MsgGenericError, self).__init__()
         self.cmd = None
         self.err = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgGenericError, cls).decode(data)
-        assert isinstance(msg, MsgGenericError)
-        msg.cmd = msg._byte()
-        msg.err = msg._byte()
-        return msg
-
     def message(self):
-        return "Command 0x%x caused error 0x%x: %s" % (self.cmd, self.err, self.DESCR[self.err])
+        descr = self.DESCR[self.err] if self.err < len(self.DESCR) else None
+        return "Command 0x%x caused error 0x%x: %s" % (self.cmd, self.err, descr or "Unknown error")
 
 
 class MsgPortInfoRequest(DownstreamMsg):
@@ -337,16 +423,14 @@ class MsgPortInfoRequest(DownstreamMsg):
     INFO_MODE_INFO = 0x01
     INFO_MODE_COMBINATIONS = 0x02
 
+    FIELDS = (("port", "B"), ("info_type", "B"))
+
     def __init__(self, port, info_type):
         super(MsgPortInfoRequest, self).__init__()
         self.port = port
         self.info_type = info_type
         self.needs_reply = True
 
-    def bytes(self):
-        self.payload = pack("<B", self.port) + pack("<B", self.info_type)
-        return super(MsgPortInfoRequest, self).bytes()
-
     def is_reply(self, msg):
         if msg.port != self.port:
             return False
@@ -356,6 +440,9 @@ class MsgPortInfoRequest(DownstreamMsg):
         else:
             return isinstance(msg, (MsgPortInfo,))
 
+    def reply_key(self):
+        return self.TYPE, self.port, self.info_type
+
 
 class MsgPortModeInfoRequest(DownstreamMsg):
     """
@@ -374,24 +461,25 @@ class MsgPortModeInfoRequest(DownstreamMsg):
     INFO_CAPABILITY_BITS = 0x08
     INFO_VALUE_FORMAT = 0x80
 
-    INFO_TYPES = {
-        INFO_NAME: "Name",
-        INFO_RAW_RANGE: "Raw range",
-        INFO_PCT_RANGE: "Percent range",
-        INFO_SI_RANGE: "SI value range",
-        INFO_UNITS: "Units",
-        INFO_MAPPING: "Mapping",
-        INFO_MOTOR_BIAS: "Motor bias",
-        INFO_CAPABILITY_BITS: "Capabilities",
-        INFO_VALUE_FORMAT: "Value encoding",
-    }
+    INFO_TYPES = (  # (info type, name) pairs
+        (INFO_NAME, "Name"),
+        (INFO_RAW_RANGE, "Raw range"),
+        (INFO_PCT_RANGE, "Percent range"),
+        (INFO_SI_RANGE, "SI value range"),
+        (INFO_UNITS, "Units"),
+        (INFO_MAPPING, "Mapping"),
+        (INFO_MOTOR_BIAS, "Motor bias"),
+        (INFO_CAPABILITY_BITS, "Capabilities"),
+        (INFO_VALUE_FORMAT, "Value encoding"),
+    )
+
+    FIELDS = (("port", "B"), ("mode", "B"), ("info_type", "B"))
 
     def __init__(self, port, mode, info_type):
         super(MsgPortModeInfoRequest, self).__init__()
         self.port = port
         self.mode = mode
         self.info_type = info_type
-        self.payload = pack("<B", port) + pack("<B", mode) + pack("<B", info_type)
         self.needs_reply = True
 
     def is_reply(self, msg):
@@ -403,6 +491,9 @@ class MsgPortModeInfoRequest(DownstreamMsg):
 
         return True
 
+    def reply_key(self):
+        return self.TYPE, self.port, self.mode, self.info_type
+
 
 class MsgPortInputFmtSetupSingle(DownstreamMsg):
     """
@@ -410,19 +501,23 @@ class MsgPortInputFmtSetupSingle(DownstreamMsg):
     """
     TYPE = 0x41
 
+    FIELDS = (("port", "B"), ("mode", "B"), ("upd_delta", "I"), ("upd_enabled", "B"))
+
     def __init__(self, port, mode, delta=1, update_enable=0):
         super(MsgPortInputFmtSetupSingle, self).__init__()
         self.port = port
         self.mode = mode
         self.upd_enabled = update_enable
         self.upd_delta = delta
-        self.payload = pack("<B", port) + pack("<B", mode) + pack("<I", delta) + pack("<B", update_enable)
         self.needs_reply = True
 
     def is_reply(self, msg):
         if isinstance(msg, MsgPortInputFmtSingle) and msg.port == self.port:
             return True
 
+    def reply_key(self):
+        return self.TYPE, self.port
+
 
 class MsgPortInputFmtSetupCombined(DownstreamMsg):
     """
@@ -430,16 +525,32 @@ class MsgPortInputFmtSetupCombined(DownstreamMsg):
     """
     TYPE = 0x42
 
-    def __init__(self, port, mode, delta=1, update_enable=0):
+    SUBCMD_SET_COMBINATION = 0x01  # combination index, then (mode << 4 | dataset) byte per value
+    SUBCMD_LOCK = 0x02  # modes are set up with MsgPortInputFmtSetupSingle while locked
+    SUBCMD_UNLOCK_ENABLED = 0x03  # starts combined updates
+    SUBCMD_UNLOCK_DISABLED = 0x04
+    SUBCMD_RESET = 0x06
+
+    FIELDS = (("port", "B"), ("subcommand", "B"))  # params follow
+
+    def __init__(self, port, subcommand, params=b""):
         super(MsgPortInputFmtSetupCombined, self).__init__()
         self.port = port
-        self.payload = pack("<B", port) + pack("<B", mode) + pack("<I", delta) + pack("<B", update_enable)
-        self.needs_reply = True
+        self.subcommand = subcommand
+        self.params = params
+        # hub tells the resulting format once the port is unlocked
+        self.needs_reply = subcommand in (self.SUBCMD_UNLOCK_ENABLED, self.SUBCMD_UNLOCK_DISABLED)
+
+    def _encode_tail(self):
+        return self.params
 
     def is_reply(self, msg):
         if isinstance(msg, MsgPortInputFmtCombined) and msg.port == self.port:
             return True
 
+    def reply_key(self):
+        return self.TYPE, self.port
+
 
 class MsgPortInfo(UpstreamMsg):
     """
@@ -452,6 +563,16 @@ class MsgPortInfo(UpstreamMsg):
     CAP_COMBINABLE = 0b00000100
     CAP_SYNCHRONIZABLE = 0b00001000
 
+    _IS_MODE_INFO = "msg.info_type == %d" % MsgPortInfoRequest.INFO_MODE_INFO
+    FIELDS = (
+        ("port", "B"),
+        ("info_type", "B"),
+        ("capabilities", "B", _IS_MODE_INFO),
+        ("total_modes", "B", _IS_MODE_INFO),
+        ("input_modes", "H", _IS_MODE_INFO),  # bit masks, turned into lists of modes
+        ("output_modes", "H", _IS_MODE_INFO),
+    )  # mode combinations follow otherwise
+
     def __init__(self):
         super(MsgPortInfo, self).__init__()
         self.port = None
@@ -462,25 +583,20 @@ class MsgPortInfo(UpstreamMsg):
         self.output_modes = None
         self.possible_mode_combinations = []
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortInfo, cls).decode(data)
-        assert isinstance(msg, MsgPortInfo)
-        msg.port = msg._byte()
-        msg.info_type = msg._byte()
-        if msg.info_type == MsgPortInfoRequest.INFO_MODE_INFO:
-            msg.capabilities = msg._byte()
-            msg.total_modes = msg._byte()
-            msg.input_modes = msg._bits_list(msg._short())
-            msg.output_modes = msg._bits_list(msg._short())
+    def _decode_tail(self):
+        if self.info_type == MsgPortInfoRequest.INFO_MODE_INFO:
+            self.input_modes = self._bits_list(self.input_modes)
+            self.output_modes = self._bits_list(self.output_modes)
         else:
-            while msg.payload:
+            while self._remaining():
                 # https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#pos-m
-                val = msg._short()
-                msg.possible_mode_combinations.append(msg._bits_list(val))
+                val = self._short()
+                self.possible_mode_combinations.append(self._bits_list(val))
                 if not val:
                     break
-        return msg
+
+    def reply_key(self):
+        return MsgPortInfoRequest.TYPE, self.port, self.info_type
 
     def is_output(self):
         assert self.info_type == MsgPortInfoRequest.INFO_MODE_INFO
@@ -505,23 +621,27 @@ class MsgPortModeInfo(UpstreamMsg):
     """
     TYPE = 0x44
 
-    MAPPING_FLAGS = {
-        7: "Supports NULL value",
-        6: "Supports Functional Mapping 2.0+",
-        5: "N/A",
-        4: "Absolute [min..max]",
-        3: "Relative [-1..1]",
-        2: "Discrete [0, 1, 2, 3]",
-        1: "N/A",
-        0: "N/A",
-    }
-
-    DATASET_TYPES = {
-        0b00: "8 bit",
-        0b01: "16 bit",
-        0b10: "32 bit",
-        0b11: "FLOAT",
-    }
+    # read-only tables are tuples, those can stay in flash when frozen into firmware, dicts can't
+    MAPPING_FLAGS = (  # by bit number
+        "N/A",
+        "N/A",
+        "Discrete [0, 1, 2, 3]",
+        "Relative [-1..1]",
+        "Absolute [min..max]",
+        "N/A",
+        "Supports Functional Mapping 2.0+",
+        "Supports NULL value",
+    )
+
+    DATASET_TYPES = (
+        "8 bit",  # 0b00
+        "16 bit",  # 0b01
+        "32 bit",  # 0b10
+        "FLOAT",  # 0b11
+    )
+    DATASET_FORMATS = ("b", "h", "i", "f")  # struct formats of DATASET_TYPES
+
+    FIELDS = (("port", "B"), ("mode", "B"), ("info_type", "B"))  # value follows
 
     def __init__(self):
         super(MsgPortModeInfo, self).__init__()
@@ -530,24 +650,20 @@ class MsgPortModeInfo(UpstreamMsg):
         self.info_type = None  # @see MsgPortModeInfoRequest
         self.value = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortModeInfo, cls).decode(data)
-        assert isinstance(msg, MsgPortModeInfo)
-        msg.port = msg._byte()
-        msg.mode = msg._byte()
-        msg.info_type = msg._byte()
-        msg.value = msg._value()
-        return msg
+    def _decode_tail(self):
+        self.value = self._value()
+
+    def reply_key(self):
+        return MsgPortModeInfoRequest.TYPE, self.port, self.mode, self.info_type
 
     def _value(self):
         info = MsgPortModeInfoRequest
         if self.info_type == info.INFO_NAME:
-            return self.payload[:self.payload.index(b"\00")].decode('ascii')
+            return self._string()
         elif self.info_type in (info.INFO_RAW_RANGE, info.INFO_PCT_RANGE, info.INFO_SI_RANGE):
             return [self._float(), self._float()]
         elif self.info_type == info.INFO_UNITS:
-            return self.payload[:self.payload.index(b"\00")].decode('ascii')
+            return self._string()
         elif self.info_type == info.INFO_MAPPING:
             inp = self._bits_list(self._byte())
             outp = self._bits_list(self._byte())
@@ -565,7 +681,7 @@ class MsgPortModeInfo(UpstreamMsg):
                 "decimals": self._byte(),
             }
         else:
-            return self.payload  # FIXME: will probably fail here
+            return str2hex(self.payload).decode('ascii')  # capability bits and others, kept as hex
 
 
 class MsgPortValueSingle(UpstreamMsg):
@@ -574,16 +690,16 @@ class MsgPortValueSingle(UpstreamMsg):
     """
     TYPE = 0x45
 
+    __slots__ = ('port',)
+
+    FIELDS = (("port", "B"),)  # values follow, peripheral decodes them
+
     def __init__(self):
         super(MsgPortValueSingle, self).__init__()
         self.port = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortValueSingle, cls).decode(data)
-        assert isinstance(msg, MsgPortValueSingle)
-        msg.port = msg._byte()
-        return msg
+    def reply_key(self):
+        return MsgPortInfoRequest.TYPE, self.port, MsgPortInfoRequest.INFO_PORT_VALUE
 
 
 class MsgPortValueCombined(UpstreamMsg):
@@ -592,16 +708,18 @@ class MsgPortValueCombined(UpstreamMsg):
     """
     TYPE = 0x46
 
+    __slots__ = ('port', 'pointer')
+
+    # pointer has a bit per value of mode combination that follows, peripheral decodes them
+    FIELDS = (("port", "B"), ("pointer", "H"))
+
     def __init__(self):
         super(MsgPortValueCombined, self).__init__()
         self.port = None
+        self.pointer = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortValueCombined, cls).decode(data)
-        assert isinstance(msg, MsgPortValueCombined)
-        msg.port = msg._byte()
-        return msg
+    def reply_key(self):
+        return MsgPortInfoRequest.TYPE, self.port, MsgPortInfoRequest.INFO_PORT_VALUE
 
 
 class MsgPortInputFmtSingle(UpstreamMsg):
@@ -610,6 +728,10 @@ class MsgPortInputFmtSingle(UpstreamMsg):
     """
     TYPE = 0x47
 
+    __slots__ = ('port', 'mode', 'upd_delta', 'upd_enabled')
+
+    FIELDS = (("port", "B"), ("mode", "B"), ("upd_delta", "I"), ("upd_enabled", "B", "remaining"))
+
     def __init__(self, port=None, mode=None, upd_enabled=None, upd_delta=None):
         super(MsgPortInputFmtSingle, self).__init__()
         self.port = port
@@ -618,36 +740,30 @@ class MsgPortInputFmtSingle(UpstreamMsg):
         self.upd_enabled = upd_enabled
         #return self
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortInputFmtSingle, cls).decode(data)
-        assert isinstance(msg, MsgPortInputFmtSingle)
-        msg.port = msg._byte()
-        msg.mode = msg._byte()
-        msg.upd_delta = msg._long()
-        if len(msg.payload):
-            msg.upd_enabled = msg._byte()
+    def reply_key(self):
+        return MsgPortInputFmtSetupSingle.TYPE, self.port
 
-        return msg
 
-
-class MsgPortInputFmtCombined(UpstreamMsg):  # TODO
+class MsgPortInputFmtCombined(UpstreamMsg):
     """
     https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#port-input-format-combinedmode
     """
     TYPE = 0x48
 
+    FIELDS = (
+        ("port", "B"),
+        ("combined_control", "B", "remaining"),
+        ("combination_pointer", "H", "remaining"),  # bit mask of mode/dataset pairs delivering updates
+    )
+
     def __init__(self):
         super(MsgPortInputFmtCombined, self).__init__()
         self.port = None
         self.combined_control = None
+        self.combination_pointer = None
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortInputFmtCombined, cls).decode(data)
-        assert isinstance(msg, MsgPortInputFmtSingle)
-        msg.port = msg._byte()
-        return msg
+    def reply_key(self):
+        return MsgPortInputFmtSetupCombined.TYPE, self.port
 
 
 class MsgVirtualPortSetup(DownstreamMsg):
@@ -659,15 +775,21 @@ class MsgVirtualPortSetup(DownstreamMsg):
     CMD_DISCONNECT = 0x00
     CMD_CONNECT = 0x01
 
+    FIELDS = (("cmd", "B"), ("port", "B"), ("port_b", "B", "msg.cmd == %d" % CMD_CONNECT))
+
     def __init__(self, cmd, port):
+        """
+        :param port: virtual port to disconnect, or pair of ports to connect
+        """
         super(MsgVirtualPortSetup, self).__init__()
-        self.payload = pack("<B", cmd)
+        self.cmd = cmd
         if cmd == self.CMD_DISCONNECT:
             assert isinstance(port, int)
-            self.payload += pack("<B", port)
+            self.port = port
+            self.port_b = None
         else:
             assert isinstance(port, (list, tuple))
-            self.payload += pack("<B", port[0]) + pack("<B", port[1])
+            self.port, self.port_b = port
 
 
 class MsgPortOutput(DownstreamMsg):
@@ -676,19 +798,40 @@ class MsgPortOutput(DownstreamMsg):
     """
     TYPE = 0x81
 
-    SC_NO_BUFFER = 0b00000001
-    SC_FEEDBACK = 0b00010000
+    __slots__ = ('port', 'is_buffered', 'do_feedback', 'startup_completion_flags', 'subcommand', 'params', '_layout')
+
+    FIELDS = (("port", "B"), ("startup_completion_flags", "B"), ("subcommand", "B"))  # params follow
+
+    SC_NO_BUFFER = 0b00010000  # execute immediately, otherwise hub buffers it after current command
+    SC_FEEDBACK = 0b00000001
 
     WRITE_DIRECT = 0x50
     WRITE_DIRECT_MODE_DATA = 0x51
 
-    def __init__(self, port, subcommand, params):
+    LAYOUT_HEADER = "BBB"  # port, startup/completion flags, subcommand
+
+    def __init__(self, port, subcommand, params, layout=None):
+        """
+        :param params: bytes, or tuple of values when layout is given
+        :type layout: MsgLayout
+        :param layout: see layout(), message is packed in place with no intermediate bytes
+        """
         super(MsgPortOutput, self).__init__()
         self.port = port
         self.is_buffered = False
         self.do_feedback = True
+        self.startup_completion_flags = 0
         self.subcommand = subcommand
         self.params = params
+        self._layout = layout
+
+    @staticmethod
+    def layout(fmt):
+        """
+        :param fmt: struct format of subcommand's params
+        :rtype: MsgLayout
+        """
+        return MsgLayout(MsgPortOutput.LAYOUT_HEADER + fmt)
 
     def bytes(self):
         startup_completion_flags = 0
@@ -697,33 +840,66 @@ class MsgPortOutput(DownstreamMsg):
 
         if self.do_feedback:
             startup_completion_flags |= self.SC_FEEDBACK
-            self.needs_reply = True
+            # buffered command's feedback is tracked by its peripheral, see Peripheral.queue_output_feedback
+            self.needs_reply = not self.is_buffered
 
-        self.payload = pack("<B", self.port) + pack("<B", startup_completion_flags) \
-                       + pack("<B", self.subcommand) + self.params
+        self.startup_completion_flags = startup_completion_flags
+        if self._layout:
+            return self._layout.pack(self.hub_id, self.TYPE, self.port, startup_completion_flags, self.subcommand,
+                                     *self.params)
         return super(MsgPortOutput, self).bytes()
 
+    def _encode_tail(self):
+        return self.params
+
     def is_reply(self, msg):
         return isinstance(msg, MsgPortOutputFeedback) and msg.port == self.port \
-               and (msg.is_completed() or self.is_buffered)
+               and (msg.is_completed() or msg.is_discarded() or msg.is_idle())
+
+    def reply_key(self):
+        return self.TYPE, self.port
+
+    def is_accepted(self, msg):
+        return isinstance(msg, MsgPortOutputFeedback) and msg.port == self.port and msg.is_in_progress()
 
 
 class MsgPortOutputFeedback(UpstreamMsg):
     TYPE = 0x82
 
-    def __init__(self):
-        super(MsgPortOutputFeedback, self).__init__()
-        self.port = None
-        self.status = None
+    __slots__ = ('port', 'status', 'feedback')
 
-    #@classmethod
-    def decode(cls, data):
-        msg = super(MsgPortOutputFeedback, cls).decode(data)
-        assert isinstance(msg, MsgPortOutputFeedback)
-        assert len(msg.payload) == 2, "TODO: implement multi-port feedback message"
-        msg.port = msg._byte()
-        msg.status = msg._byte()
-        return msg
+    FIELDS = (("port", "B"), ("status", "B"))  # more (port, status) pairs may follow
+
+    def __init__(self, port=None, status=None):
+        super(MsgPortOutputFeedback, self).__init__()
+        self.port = port
+        self.status = status
+        self.feedback = ()  # (port, status) pairs, hub may report several ports in one message
+
+    def _decode_tail(self):
+        if not self._remaining():
+            self.feedback = ((self.port, self.status),)
+            return
+
+        assert self._remaining() % 2 == 0, "Unexpected feedback length: %s" % self._remaining()
+        feedback = [(self.port, self.status)]
+        while self._remaining():
+            feedback.append((self._byte(), self._byte()))
+        self.feedback = tuple(feedback)
+
+    def split(self):
+        if len(self.feedback) < 2:
+            return None
+
+        parts = []
+        for port, status in self.feedback:
+            part = MsgPortOutputFeedback(port, status)
+            part.feedback = ((port, status),)
+            parts.append(part)
+        return parts
+
+    def reply_key(self):
+        return MsgPortOutput.TYPE, self.port
 
     def is_in_progress(self):
         return self.status & 0b0001
@@ -737,6 +913,9 @@ class MsgPortOutputFeedback(UpstreamMsg):
     def is_idle(self):
         return self.status & 0b1000
 
+    def is_busy(self):
+        return self.status & 0b10000  # buffer is full
+
 
 UPSTREAM_MSGS = (
     MsgHubProperties, MsgHubAction, MsgHubAlert, MsgHubAttachedIO, MsgGenericError,
@@ -744,3 +923,109 @@ UPSTREAM_MSGS = (
     MsgPortValueSingle, MsgPortValueCombined, MsgPortInputFmtSingle, MsgPortInputFmtCombined,
     MsgPortOutputFeedback
 )
+
+DOWNSTREAM_MSGS = (
+    MsgHubProperties, MsgHubAction, MsgHubAlert,
+    MsgPortInfoRequest, MsgPortModeInfoRequest, MsgPortInputFmtSetupSingle, MsgPortInputFmtSetupCombined,
+    MsgVirtualPortSetup, MsgPortOutput
+)
+
+for _msg_kind in UPSTREAM_MSGS:
+    compile_codec(_msg_kind, encode=_msg_kind in DOWNSTREAM_MSGS)
+for _msg_kind in DOWNSTREAM_MSGS:
+    if _msg_kind not in UPSTREAM_MSGS:
+        compile_codec(_msg_kind, decode=False)
+
+# message type byte -> decoder class, so incoming frames are decoded without scanning UPSTREAM_MSGS
+UPSTREAM_MSGS_BY_TYPE = {msg_kind.TYPE: msg_kind for msg_kind in UPSTREAM_MSGS}
+
+
+class FrameSplitter(object):
+    """
+    Cuts notifications into messages. One notification may carry several messages one after another,
+    a message longer than notification size comes in pieces and gets put back together here.
+    """
+
+    def __init__(self):
+        self.dropped = 0  # bytes thrown away as not looking like a message
+        self._tail = b""  # beginning of a message waiting for the rest of it
+
+    def reset(self):
+        self._tail = b""
+
+    def feed(self, data):
+        """
+        :return: list of complete messages, views into data unless they were reassembled
+        """
+        if self._tail:
+            data = self._tail + bytes(data)
+            self._tail = b""
+
+        frames = []
+        view = memoryview(data)
+        pos = 0
+        size = len(data)
+        while pos < size:
+            header = decode_length(view, pos)
+            if header is None:
+                break
+            msglen = header[0]
+            if msglen < header[1] + 2:  # not even hub id and type
+                self.dropped += size - pos
+                return frames
+            if pos + msglen > size:
+                break
+            frames.append(view[pos:pos + msglen])
+            pos += msglen
+
+        if pos < size:
+            self._tail = bytes(view[pos:])
+        return frames
+
+
+POOLED_MSGS = (MsgPortValueSingle, MsgPortValueCombined, MsgPortOutputFeedback)
+
+
+class MsgPool(object):
+    """
+    Recycles messages that arrive many times a second, so decoding them does not churn the heap.
+
+    A pooled message belongs to the pool: handlers and subscribers may use it while it's being dispatched,
+    anything kept beyond that (pending replies, queues) has to be UpstreamMsg.copy() of it.
+    Pooled classes have to decode all of their fields, leftovers of previous message would show otherwise.
+    """
+    __slots__ = ('size', 'created', 'reused', '_free')
+
+    def __init__(self, kinds=POOLED_MSGS, size=2):
+        """
+        :param size: spare instances kept per class, more are needed only when dispatch nests
+        """
+        self.size = size
+        self.created = 0
+        self.reused = 0
+        self._free = {msg_kind: [] for msg_kind in kinds}
+
+    def is_pooled(self, msg):
+        return type(msg) in self._free
+
+    def decode(self, msg_kind, data):
+        """
+        :rtype: UpstreamMsg
+        """
+        free = self._free.get(msg_kind)
+        if free:
+            self.reused += 1
+            return msg_kind.decode(msg_kind, data, free.pop())
+
+        if free is not None:
+            self.created += 1
+        return msg_kind.decode(msg_kind, data)
+
+    def release(self, msg):
+        """
+        Takes message back once it's dispatched, messages of other classes are left alone
+        """
+        free = self._free.get(type(msg))
+        if free is not None and len(free) < self.size:
+            msg.payload = b""  # not to hold the notification buffer
+            free.append(msg)
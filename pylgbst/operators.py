@@ -0,0 +1,202 @@
+"""
+Operators filtering and reducing port values before they reach subscribers, see Peripheral.subscribe.
+Each one gets a decoded value tuple and returns a tuple to pass on, or None to drop the value.
+
+Operators keep state, so a chain of them is run once per value for all the subscribers
+that asked for an identical chain, and callbacks of a slow consumer are called only as often as it needs.
+"""
+from pylgbst.utilities import ticks_diff, ticks_ms
+
+
+class Operator(object):
+    """
+    Passes every value as it is, subclasses override __call__ to filter or reduce them
+    """
+    PARAMS = ()  # attributes telling identical operators apart
+
+    __slots__ = ()
+
+    def __call__(self, value):
+        """
+        :type value: tuple
+        :return: value to pass on, None to drop it
+        """
+        return value
+
+    def key(self):
+        return (type(self),) + tuple(getattr(self, name) for name in self.PARAMS)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(repr(getattr(self, name)) for name in self.PARAMS))
+
+
+class Deadband(Operator):
+    """
+    Passes a value when any of its items moved at least delta away from the value passed last
+    """
+    PARAMS = ('delta',)
+
+    __slots__ = ('delta', '_last')
+
+    def __init__(self, delta):
+        self.delta = delta
+        self._last = None
+
+    def __call__(self, value):
+        last = self._last
+        if last is not None and len(last) == len(value):
+            for new, old in zip(value, last):
+                if new is None or old is None:
+                    if new is not old:
+                        break
+                elif abs(new - old) >= self.delta:
+                    break
+            else:
+                return None
+        self._last = value
+        return value
+
+
+class EveryNth(Operator):
+    """
+    Passes first value of every n
+    """
+    PARAMS = ('n',)
+
+    __slots__ = ('n', '_count')
+
+    def __init__(self, n):
+        assert n > 0
+        self.n = n
+        self._count = 0
+
+    def __call__(self, value):
+        count = self._count
+        self._count = (count + 1) % self.n
+        return value if not count else None
+
+
+class RateLimit(Operator):
+    """
+    Passes at most one value per interval
+    """
+    PARAMS = ('interval_ms',)
+
+    __slots__ = ('interval_ms', '_last')
+
+    def __init__(self, interval_ms):
+        self.interval_ms = interval_ms
+        self._last = None
+
+    def __call__(self, value):
+        now = ticks_ms()
+        if self._last is not None and ticks_diff(now, self._last) < self.interval_ms:
+            return None
+        self._last = now
+        return value
+
+
+class Window(Operator):
+    """
+    Collects size values and passes their minimum, maximum or mean, item by item
+    """
+    MIN = 0
+    MAX = 1
+    MEAN = 2
+
+    PARAMS = ('size', 'how')
+
+    __slots__ = ('size', 'how', '_acc', '_count')
+
+    def __init__(self, size, how=MEAN):
+        assert size > 0
+        self.size = size
+        self.how = how
+        self._acc = None
+        self._count = 0
+
+    def __call__(self, value):
+        acc = self._acc
+        if acc is None or len(acc) != len(value):
+            acc = self._acc = list(value)
+            self._count = 1
+        else:
+            for i, item in enumerate(value):
+                if self.how == self.MIN:
+                    if item < acc[i]:
+                        acc[i] = item
+                elif self.how == self.MAX:
+                    if item > acc[i]:
+                        acc[i] = item
+                else:
+                    acc[i] += item
+            self._count += 1
+
+        if self._count < self.size:
+            return None
+
+        self._acc = None
+        if self.how == self.MEAN:
+            return tuple(item / self.size for item in acc)
+        return tuple(acc)
+
+
+class Threshold(Operator):
+    """
+    Passes a value when its item crosses the level, so only the edges reach subscribers
+    """
+    RISING = 1
+    FALLING = 2
+    BOTH = 3
+
+    PARAMS = ('level', 'index', 'edge')
+
+    __slots__ = ('level', 'index', 'edge', '_above')
+
+    def __init__(self, level, index=0, edge=BOTH):
+        """
+        :param index: item of value tuple to watch
+        """
+        self.level = level
+        self.index = index
+        self.edge = edge
+        self._above = None
+
+    def __call__(self, value):
+        item = value[self.index]
+        if item is None:
+            return None
+
+        above = item >= self.level
+        was_above = self._above
+        self._above = above
+        if was_above is None or above == was_above:
+            return None
+        return value if self.edge & (self.RISING if above else self.FALLING) else None
+
+
+class Pipeline(object):
+    """
+    Chain of operators with the callbacks fed by it, itself a subscriber of the peripheral
+    """
+    __slots__ = ('ops', 'key', 'callbacks')
+
+    def __init__(self, ops):
+        self.ops = tuple(ops)
+        self.key = chain_key(ops)
+        self.callbacks = set()
+
+    def __call__(self, value):
+        for op in self.ops:
+            value = op(value)
+            if value is None:
+                return
+        for callback in self.callbacks.copy():
+            callback(value)
+
+    def __repr__(self):
+        return "%s%r" % (self.__class__.__name__, self.ops)
+
+
+def chain_key(ops):
+    return tuple(op.key() for op in ops)
@@ -1,29 +1,32 @@
 import logging
 import math
 import traceback
-from ustruct import pack, unpack
+from ustruct import calcsize, unpack_from
 #from threading import Thread
 
 from pylgbst.messages import MsgHubProperties, MsgPortOutput, MsgPortInputFmtSetupSingle, MsgPortInfoRequest, \
-    MsgPortModeInfoRequest, MsgPortInfo, MsgPortModeInfo, MsgPortInputFmtSingle
+    MsgPortModeInfoRequest, MsgPortInfo, MsgPortModeInfo, MsgPortInputFmtSingle, MsgPortInputFmtSetupCombined, \
+    MsgPortInputFmtCombined, MsgPortValueCombined, MsgGenericError
 #from pylgbst.utilities import queue, str2hex, usbyte, ushort, usint
-from pylgbst.utilities import str2hex, usbyte, ushort, usint
+from pylgbst.operators import Pipeline, chain_key
+from pylgbst.samples import SampleRing
+from pylgbst.utilities import Event, const, usbyte
 
 log = logging.getLogger('peripherals')
 
 # COLORS
-COLOR_BLACK = 0x00
-COLOR_PINK = 0x01
-COLOR_PURPLE = 0x02
-COLOR_BLUE = 0x03
-COLOR_LIGHTBLUE = 0x04
-COLOR_CYAN = 0x05
-COLOR_GREEN = 0x06
-COLOR_YELLOW = 0x07
-COLOR_ORANGE = 0x08
-COLOR_RED = 0x09
-COLOR_WHITE = 0x0a
-COLOR_NONE = 0xFF
+COLOR_BLACK = const(0x00)
+COLOR_PINK = const(0x01)
+COLOR_PURPLE = const(0x02)
+COLOR_BLUE = const(0x03)
+COLOR_LIGHTBLUE = const(0x04)
+COLOR_CYAN = const(0x05)
+COLOR_GREEN = const(0x06)
+COLOR_YELLOW = const(0x07)
+COLOR_ORANGE = const(0x08)
+COLOR_RED = const(0x09)
+COLOR_WHITE = const(0x0a)
+COLOR_NONE = const(0xFF)
 COLORS = {
     COLOR_BLACK: "BLACK",
     COLOR_PINK: "PINK",
@@ -40,6 +43,153 @@ COLORS = {
 }
 
 
+class ValueDecoder(object):
+    """
+    Decodes port value of a mode with a single unpack_from, and scales it if needed:
+    linearly with precomputed scale and offset, or with integer math when divisor is given.
+    """
+    __slots__ = ('fmt', 'scale', 'divisor', 'offset')
+
+    def __init__(self, fmt, scale=None, divisor=None, offset=0):
+        self.fmt = fmt
+        self.scale = scale
+        self.divisor = divisor
+        self.offset = offset
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r)" % (self.__class__.__name__, self.fmt, self.scale, self.divisor, self.offset)
+
+    def decode(self, data):
+        """
+        :rtype: tuple
+        """
+        values = unpack_from(self.fmt, data, 0)
+        if self.scale is None:
+            return values
+        if self.divisor is None:
+            if len(values) == 1:  # most of the sensors
+                return (values[0] * self.scale + self.offset,)
+            return tuple([val * self.scale + self.offset for val in values])
+        return tuple([val * self.scale // self.divisor for val in values])
+
+    def typecode(self):
+        """
+        :return: array typecode that holds every value item this decoder gives
+        """
+        if self.scale is not None and self.divisor is None:
+            return 'f'
+        if 'I' in self.fmt or 'L' in self.fmt:
+            signed = [code for code in self.fmt if code in "bhilq"]
+            return 'q' if signed else 'L'  # unsigned 32 bit values don't fit 'i'
+        return 'i'
+
+
+class ColorDistanceDecoder(ValueDecoder):
+    """
+    Color and distance, with distance refined by a fraction sent separately
+    """
+    __slots__ = ()
+
+    def decode(self, data):
+        color, val, partial = unpack_from(self.fmt, data, 0)
+        if partial:
+            val += 1.0 / partial
+        return color, float(val)
+
+    def typecode(self):
+        return 'f'
+
+
+class RatioDecoder(ValueDecoder):
+    """
+    Single value multiplied by scale, then divided by each of divisors in turn, in the order
+    the sensor's formula has it, so values don't lose last bits to a precomputed factor
+    """
+    __slots__ = ()
+
+    def decode(self, data):
+        val = unpack_from(self.fmt, data, 0)[0] * self.scale
+        for divisor in self.divisor:
+            val /= divisor
+        return (val,)
+
+    def typecode(self):
+        return 'f'
+
+
+class Combination(object):
+    """
+    State of a combined mode subscription. Raw bytes of every mode are kept between notifications,
+    as each one carries only the datasets that changed, and a mode is decoded by its mode's decoder
+    once all of its datasets are known.
+    """
+    __slots__ = ('modes', 'datasets', 'masks', 'buffers', 'decoders', 'latest', 'known')
+
+    def __init__(self, values, decoders):
+        """
+        :param values: (mode, dataset, struct format) per value, grouped by mode, see Peripheral._combined_plan
+        :param decoders: dict of mode -> ValueDecoder, None for modes to give raw
+        """
+        modes = []
+        formats = {}
+        for mode, _, fmt in values:
+            if mode not in formats:
+                modes.append(mode)
+                formats[mode] = ""
+            formats[mode] += fmt
+
+        self.modes = tuple(modes)
+        datasets = []  # (mode index, offset in mode's buffer, size) per value
+        for mode, dataset, fmt in values:
+            datasets.append((modes.index(mode), calcsize("<" + formats[mode][:dataset]), calcsize(fmt)))
+        self.datasets = tuple(datasets)
+        self.masks = [0] * len(modes)  # pointer bits of each mode's values
+        for bit, (index, _, _) in enumerate(datasets):
+            self.masks[index] |= 1 << bit
+        self.buffers = [bytearray(calcsize("<" + formats[mode])) for mode in modes]
+        self.decoders = [decoders.get(mode) or ValueDecoder("<" + formats[mode]) for mode in modes]
+        self.latest = [None] * len(modes)  # decoded values of each mode
+        self.known = 0  # pointer bits of values received so far
+
+    def __repr__(self):
+        return "%s%r" % (self.__class__.__name__, self.modes)
+
+    def typecode(self):
+        """
+        :return: array typecode that holds values of all the modes
+        """
+        codes = [decoder.typecode() for decoder in self.decoders]
+        if 'f' in codes:
+            return 'f'
+        if 'q' in codes or ('L' in codes and 'i' in codes):
+            return 'q'
+        return codes[0] if codes and all(code == codes[0] for code in codes) else 'i'
+
+    def update(self, pointer, data):
+        """
+        :param pointer: bit per value, set for the values carried by data
+        :return: tuple of latest values of all the modes, in order they were given,
+            None until each mode has been received once
+        """
+        offset = 0
+        for bit, (index, start, size) in enumerate(self.datasets):
+            if pointer & (1 << bit):
+                self.buffers[index][start:start + size] = data[offset:offset + size]
+                offset += size
+        self.known |= pointer
+
+        for index, mask in enumerate(self.masks):
+            if pointer & mask and self.known & mask == mask:
+                self.latest[index] = self.decoders[index].decode(self.buffers[index])
+
+        values = ()
+        for decoded in self.latest:
+            if decoded is None:
+                return None
+            values += tuple(decoded)
+        return values
+
+
 # TODO: support more types of peripherals from
 # https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#io-type-id
 
@@ -49,6 +199,14 @@ class Peripheral(object):
     :type _incoming_port_data: queue.Queue
     :type _port_mode: MsgPortInputFmtSingle
     """
+    HUB_OUTPUT_SLOTS = 2  # command being executed plus one buffered to start after it
+
+    DECODERS = ()  # ValueDecoder by mode number, None for modes with no values to decode
+
+    # subclasses declare empty __slots__ to stay dict-less
+    __slots__ = ('virtual_ports', 'hub', 'port', 'dev_type', 'hw_revision', 'sw_revision', 'is_buffered',
+                 'drain_callback', '_output_queue', '_output_in_hub', '_output_acked', '_output_drained', '_layouts',
+                 '_subscribers', '_port_mode', '_decoder', '_combined', '_samples', '_incoming_port_data')
 
     def __init__(self, parent, port):
         """
@@ -59,11 +217,25 @@ class Peripheral(object):
         self.virtual_ports = ()
         self.hub = parent
         self.port = port
+        self.dev_type = None
+        self.hw_revision = None  # revisions are known for physical ports only
+        self.sw_revision = None
 
+        # buffered output commands are queued on the hub and sent without waiting for completion
         self.is_buffered = False
-
+        self.drain_callback = None  # called when all buffered commands are done
+        self._output_queue = []  # buffered commands not sent to the hub yet
+        self._output_in_hub = 0  # commands executed or held by the hub, as its feedback tells
+        self._output_acked = True  # hub reported its state after our last command
+        self._output_drained = Event()
+        self._output_drained.set()
+
+        self._layouts = {}  # params format -> MsgLayout, output commands are packed in place
         self._subscribers = set()
         self._port_mode = MsgPortInputFmtSingle(self.port, None, False, 1)
+        self._decoder = None  # DECODERS entry of current mode
+        self._combined = None  # Combination of combined mode subscription
+        self._samples = None  # SampleRing capturing decoded values, see record
 
         self._incoming_port_data = () #queue.Queue(1)  # limit 1 means we drop data if we can't handle it fast enough
         #thr = Thread(target=self._queue_reader)
@@ -78,6 +250,33 @@ class Peripheral(object):
         return msg
 
     def set_port_mode(self, mode, send_updates=None, update_delta=None):
+        msg = self._port_mode_request(mode, send_updates, update_delta)
+        if msg:
+            resp = self.hub.send(msg)
+            assert isinstance(resp, MsgPortInputFmtSingle)
+            self._use_port_mode(resp)
+
+    def _use_port_mode(self, msg):
+        """
+        :type msg: MsgPortInputFmtSingle
+        """
+        self._port_mode = msg
+        self._decoder = self._mode_decoder(msg.mode)
+
+    def _mode_decoder(self, mode):
+        """
+        :rtype: ValueDecoder
+        :return: None if mode has no decoder
+        """
+        if mode is None or mode >= len(self.DECODERS):
+            return None
+        return self.DECODERS[mode]
+
+    def _port_mode_request(self, mode, send_updates, update_delta):
+        """
+        :rtype: MsgPortInputFmtSetupSingle
+        :return: None if port is already in target mode
+        """
         assert not self.virtual_ports, "TODO: support combined mode for sensors"
 
         if send_updates is None:
@@ -92,17 +291,84 @@ class Peripheral(object):
                 and self._port_mode.upd_enabled == send_updates \
                 and self._port_mode.upd_delta == update_delta:
             log.debug("Already in target mode, no need to switch")
-            return
-        else:
-            msg = MsgPortInputFmtSetupSingle(self.port, mode, update_delta, send_updates)
-            resp = self.hub.send(msg)
-            assert isinstance(resp, MsgPortInputFmtSingle)
-            self._port_mode = resp
+            return None
+
+        return MsgPortInputFmtSetupSingle(self.port, mode, update_delta, send_updates)
+
+    def _output_msg(self, subcmd, fmt, params):
+        """
+        Output command to be packed with a layout kept by this peripheral, not to allocate on every command
 
-    def _send_output(self, msg):
+        :param fmt: struct format of params
+        :type params: tuple
+        :rtype: MsgPortOutput
+        """
+        layout = self._layouts.get(fmt)
+        if layout is None:
+            layout = MsgPortOutput.layout(fmt)
+            self._layouts[fmt] = layout
+        return MsgPortOutput(self.port, subcmd, params, layout)
+
+    def _send_output(self, msg, wait=True):
+        """
+        :param wait: False to return right away, with PendingReply resolving on completion
+        """
         assert isinstance(msg, MsgPortOutput)
-        msg.is_buffered = self.is_buffered  # TODO: support buffering
-        self.hub.send(msg)
+        msg.is_buffered = self.is_buffered
+        if msg.is_buffered:
+            self._queue_output(msg)
+            return None
+        if not wait:
+            return self.hub.request(msg)
+        return self.hub.send(msg)
+
+    def _queue_output(self, msg):
+        with self.hub._comm_lock:
+            self._output_drained.clear()
+            self._output_queue.append(msg)
+            self._pump_output()
+
+    def _pump_output(self):
+        # one command per hub's report, so we never overfill its buffer
+        if self._output_queue and self._output_acked and self._output_in_hub < self.HUB_OUTPUT_SLOTS:
+            msg = self._output_queue.pop(0)
+            self._output_in_hub += 1
+            self._output_acked = False
+            self.hub.request(msg)
+            self.hub.flush()  # the next one goes on hub's feedback, which this one has to reach the hub for
+
+    def queue_output_feedback(self, msg):
+        """
+        :type msg: pylgbst.messages.MsgPortOutputFeedback
+        """
+        with self.hub._comm_lock:
+            if not self._output_queue and not self._output_in_hub:
+                return  # no buffered commands in flight
+
+            self._output_acked = True
+            if msg.is_busy():
+                self._output_in_hub = self.HUB_OUTPUT_SLOTS
+            elif msg.is_in_progress():
+                self._output_in_hub = 1
+            else:
+                self._output_in_hub = 0
+            self._pump_output()
+            drained = not self._output_queue and not self._output_in_hub
+
+        if drained:
+            log.debug("Buffered commands are done on %s", self)
+            self._output_drained.set()
+            if self.drain_callback:
+                self.drain_callback(self)
+
+    def wait_output(self, timeout=None):
+        """
+        Waits for buffered commands to complete
+
+        :return: False if timeout has expired first
+        """
+        self.hub.flush()
+        return self._output_drained.wait(timeout)
 
     def get_sensor_data(self, mode):
         self.set_port_mode(mode)
@@ -110,22 +376,128 @@ class Peripheral(object):
         resp = self.hub.send(msg)
         return self._decode_port_data(resp)
 
-    def subscribe(self, callback, mode=0x00, granularity=1):
-        if self._port_mode.mode != mode and self._subscribers:
+    def subscribe(self, callback, mode=0x00, granularity=1, ops=()):
+        """
+        :param ops: chain of pylgbst.operators run on values before they reach callback,
+            subscribers with identical chains share one
+        """
+        if (self._port_mode.mode != mode or self._combined) and self._subscribers:
             raise ValueError("Port is in active mode %r, unsubscribe all subscribers first" % self._port_mode)
         self.set_port_mode(mode, True, granularity)
         if callback:
+            self._add_subscriber(callback, ops)
+
+    def _add_subscriber(self, callback, ops):
+        if not ops:
             self._subscribers.add(callback)
+            return
 
-    def unsubscribe(self, callback=None):
+        key = chain_key(ops)
+        for subscriber in self._subscribers:
+            if isinstance(subscriber, Pipeline) and subscriber.key == key:
+                break
+        else:
+            subscriber = Pipeline(ops)
+            self._subscribers.add(subscriber)
+        subscriber.callbacks.add(callback)
+
+    def _remove_subscriber(self, callback):
         if callback in self._subscribers:
             self._subscribers.remove(callback)
+            return
+
+        for subscriber in self._subscribers:
+            if isinstance(subscriber, Pipeline) and callback in subscriber.callbacks:
+                subscriber.callbacks.remove(callback)
+                if not subscriber.callbacks:
+                    self._subscribers.remove(subscriber)
+                return
+
+    def subscribe_combined(self, callback, modes, granularity=1, ops=()):
+        """
+        Subscribes to several modes at once, so a single notification carries values of all of them.
+        Callback gets a tuple of the latest values of all the modes, each decoded as subscribe() would,
+        in the order modes are given, once every mode has been received.
+
+        :param modes: list of modes, port has to allow them together in one of its possible_mode_combinations
+        :param ops: chain of pylgbst.operators run on values before they reach callback, see subscribe
+        """
+        if self._subscribers:
+            raise ValueError("Port is in active mode %r, unsubscribe all subscribers first" % self._port_mode)
+        index, values = self._combined_plan(self.describe_possible_modes(), modes)
+        replies = self.hub.send_all(self._combined_requests(index, values, granularity))
+        self._start_combined(values, replies)
+        if callback:
+            self._add_subscriber(callback, ops)
+
+    def unsubscribe(self, callback=None):
+        self._remove_subscriber(callback)
 
         if not self._port_mode.upd_enabled:
             log.warning("Attempt to unsubscribe while port value updates are off: %s", self)
         elif not self._subscribers:
+            if self._combined:
+                self._combined = None
+                self.hub.send(self._combined_reset())
             self.set_port_mode(self._port_mode.mode, False)
 
+    def _combined_plan(self, info, modes):
+        """
+        Finds mode combination of the port that has all the modes
+
+        :param info: result of describe_possible_modes
+        :return: index of combination, and (mode, dataset, struct format) for every value
+        """
+        assert modes, "No modes to combine"
+        for index, combination in enumerate(info.get("possible_mode_combinations", ())):
+            if all(mode in combination for mode in modes):
+                break
+        else:
+            raise ValueError("%s can't combine modes %s" % (self, modes))
+
+        values = []
+        for mode in modes:
+            value_format = info["modes"][mode]["Value encoding"]
+            fmt = MsgPortModeInfo.DATASET_FORMATS[MsgPortModeInfo.DATASET_TYPES.index(value_format["type"])]
+            for dataset in range(value_format["datasets"]):
+                values.append((mode, dataset, fmt))
+
+        if len(values) > 16:
+            raise ValueError("Modes %s give %s values, combined mode carries up to 16" % (modes, len(values)))
+        return index, values
+
+    def _combined_requests(self, index, values, granularity):
+        """
+        Port is locked, its modes set up one by one, combined and unlocked, see
+        https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#port-input-format-setup-combinedmode
+        """
+        setup = MsgPortInputFmtSetupCombined
+        msgs = [setup(self.port, setup.SUBCMD_LOCK)]
+        modes = []
+        for mode, _, _ in values:
+            if mode not in modes:
+                modes.append(mode)
+                msgs.append(MsgPortInputFmtSetupSingle(self.port, mode, granularity, True))
+        params = bytes([index] + [mode << 4 | dataset for mode, dataset, _ in values])
+        msgs.append(setup(self.port, setup.SUBCMD_SET_COMBINATION, params))
+        msgs.append(setup(self.port, setup.SUBCMD_UNLOCK_ENABLED))
+        return msgs
+
+    def _combined_reset(self):
+        """
+        Combined mode is left explicitly, single mode setup alone isn't guaranteed to end it
+        """
+        return MsgPortInputFmtSetupCombined(self.port, MsgPortInputFmtSetupCombined.SUBCMD_RESET)
+
+    def _start_combined(self, values, replies):
+        assert isinstance(replies[-1], MsgPortInputFmtCombined)
+        assert isinstance(replies[-3], MsgPortInputFmtSingle)
+        self._use_port_mode(replies[-3])  # last mode set up, updates enabled
+        decoders = {}
+        for mode, _, _ in values:
+            decoders[mode] = self._mode_decoder(mode)
+        self._combined = Combination(values, decoders)
+
     def _notify_subscribers(self, *args, **kwargs):
         for subscriber in self._subscribers.copy():
             subscriber(*args, **kwargs)
@@ -144,9 +516,14 @@ class Peripheral(object):
 
     def _decode_port_data(self, msg):
         """
+        Decodes with current mode's entry of DECODERS, chosen when mode changes
+
         :rtype: tuple
         """
-        print("Unhandled port data: ", msg)
+        if self._decoder is not None:
+            return self._decoder.decode(msg.payload)
+
+        log.debug("Got %s data while in unexpected mode: %r", self.__class__.__name__, self._port_mode)
         #return None
         return ()
 
@@ -154,12 +531,56 @@ class Peripheral(object):
         """
         :type msg: pylgbst.messages.MsgPortValueSingle
         """
-        #print("Message: ",msg)
-        decoded = self._decode_port_data(msg)
+        if self._combined and isinstance(msg, MsgPortValueCombined):
+            decoded = self._combined.update(msg.pointer, msg.payload)
+            if decoded is None:
+                return  # some mode has not been received yet
+        else:
+            #print("Message: ",msg)
+            decoded = self._decode_port_data(msg)
         #print("*Decoded stuff: ",*decoded)
         assert isinstance(decoded, (tuple, list)), "Unexpected data type: %s" % type(decoded)
+        if self._samples is not None:
+            self._samples.add(decoded)
         self._notify_subscribers(decoded)
 
+    def record(self, capacity=256, typecode=None):
+        """
+        Starts keeping the last decoded values of the port, with their arrival time, in constant memory.
+        Values come as long as the port sends updates, see subscribe.
+
+        :param typecode: array typecode of value items, by default the one of current mode's decoder,
+            or of its value format when capability cache knows it, told from the first value otherwise
+        :rtype: SampleRing
+        """
+        if typecode is None and self._combined:
+            typecode = self._combined.typecode()
+        elif typecode is None:
+            typecode = self._value_typecode(self._port_mode.mode)
+        self._samples = SampleRing(capacity, typecode)
+        return self._samples
+
+    def stop_recording(self):
+        """
+        :rtype: SampleRing
+        :return: the capture, None if there was none
+        """
+        samples = self._samples
+        self._samples = None
+        return samples
+
+    def _value_typecode(self, mode):
+        if mode is not None and mode == self._port_mode.mode and self._decoder is not None:
+            return self._decoder.typecode()
+
+        key = self.capability_key()
+        info = self.hub.capabilities.get(key) if key else None
+        if not info or mode is None or mode >= len(info["modes"]) or "Value encoding" not in info["modes"][mode]:
+            return None
+        dataset_type = MsgPortModeInfo.DATASET_TYPES.index(info["modes"][mode]["Value encoding"]["type"])
+        # a size up, as some decoders read 8 and 16 bit values unsigned
+        return ("h", "i", "i", "f")[dataset_type]
+
     def _queue_reader(self):
         while True:
             msg = self._incoming_port_data
@@ -168,7 +589,30 @@ class Peripheral(object):
             except BaseException:
                 log.warning("%s", traceback.format_exc())
 
+    def capability_key(self):
+        """
+        :return: key for hub's capability cache, None if device can't be identified
+        """
+        if self.dev_type is None or self.hw_revision is None:
+            return None
+        return self.hub.capabilities.key(self.dev_type, self.hw_revision, self.sw_revision)
+
     def describe_possible_modes(self):
+        """
+        Asks the hub for port's capabilities and every mode's details, or takes them from hub's capability cache.
+        Only complete descriptions get cached: a request timing out raises ReplyTimeout and nothing is stored.
+        """
+        key = self.capability_key()
+        info = self.hub.capabilities.get(key) if key else None
+        if info is None:
+            info = self._query_possible_modes()
+            if key:
+                self.hub.capabilities.put(key, info)
+
+        log.debug("Port info for 0x%x: %s", self.port, info)
+        return info
+
+    def _query_possible_modes(self):
         mode_info = self.hub.send(MsgPortInfoRequest(self.port, MsgPortInfoRequest.INFO_MODE_INFO))
         assert isinstance(mode_info, MsgPortInfo)
         info = {
@@ -188,66 +632,144 @@ class Peripheral(object):
             assert isinstance(mode_combinations, MsgPortInfo)
             info['possible_mode_combinations'] = mode_combinations.possible_mode_combinations
 
-        info['modes'] = []
-        for mode in range(256):
-            info['modes'].append(self._describe_mode(mode))
+        # modes are numbered from zero, input and output lists refer to the same descriptions
+        info['modes'] = [self._describe_mode(mode) for mode in range(mode_info.total_modes)]
 
         for mode in mode_info.output_modes:
-            info['output_modes'].append(self._describe_mode(mode))
+            info['output_modes'].append(info['modes'][mode])
 
         for mode in mode_info.input_modes:
-            info['input_modes'].append(self._describe_mode(mode))
+            info['input_modes'].append(info['modes'][mode])
 
-        log.debug("Port info for 0x%x: %s", self.port, info)
         return info
 
     def _describe_mode(self, mode):
         descr = {"Mode": mode}
-        for info in MsgPortModeInfoRequest.INFO_TYPES:
+        # all the info requests go out at once, their round trips overlap
+        pendings = [(info, name, self.hub.request(MsgPortModeInfoRequest(self.port, mode, info)))
+                    for info, name in MsgPortModeInfoRequest.INFO_TYPES]
+        for index, (info, name, pending) in enumerate(pendings):
             try:
-                resp = self.hub.send(MsgPortModeInfoRequest(self.port, mode, info))
-                assert isinstance(resp, MsgPortModeInfo)
-                descr[MsgPortModeInfoRequest.INFO_TYPES[info]] = resp.value
+                resp = pending.wait()
             except RuntimeError:
-                log.debug("Got error while requesting info 0x%x: %s", info, traceback.format_exc())
-                if info == MsgPortModeInfoRequest.INFO_NAME:
-                    break
+                if not isinstance(pending.reply, MsgGenericError):
+                    self._forget_pendings(pendings[index + 1:])
+                    raise  # timed out, description would be incomplete
+                log.debug("Mode %s has no info 0x%x: %s", mode, info, pending.reply.message())
+                continue
+            assert isinstance(resp, MsgPortModeInfo)
+            descr[name] = resp.value
         return descr
 
+    def _forget_pendings(self, pendings):
+        for _, _, pending in pendings:
+            self.hub._forget_pending(pending)
+
+
+class GenericPeripheral(Peripheral):
+    """
+    Device with no dedicated class, decoding values after what it tells about its modes:
+    value format gives struct format, raw and SI ranges give linear transform of raw values into SI units.
+    Modes are described once, on first mode change, or taken from hub's capability cache.
+    """
+    __slots__ = ('_compiled',)
+
+    def __init__(self, parent, port):
+        super(GenericPeripheral, self).__init__(parent, port)
+        self._compiled = None  # ValueDecoder by mode, from describe_possible_modes
+
+    def _mode_decoder(self, mode):
+        if mode is None:
+            return None
+        if self._compiled is None:
+            info = self._mode_info()
+            if info is None:
+                return None
+            self._compiled = self._compile_decoders(info)
+        return self._compiled[mode] if mode < len(self._compiled) else None
+
+    def _mode_info(self):
+        """
+        :return: None if modes can't be described now, next mode change asks again
+        """
+        try:
+            return self.describe_possible_modes()
+        except RuntimeError:
+            log.warning("Failed to describe modes of %s, its values are not decoded until next mode change", self)
+            return None
+
+    def _compile_decoders(self, info):
+        """
+        :param info: result of describe_possible_modes
+        :rtype: tuple
+        """
+        return tuple(self._compile_decoder(descr) for descr in info.get("modes", ()))
+
+    @staticmethod
+    def _compile_decoder(descr):
+        """
+        :param descr: mode description, see Peripheral._describe_mode
+        :rtype: ValueDecoder
+        :return: None for modes with no known value format
+        """
+        value_format = descr.get("Value encoding")
+        if not value_format or not value_format["datasets"]:
+            return None
+
+        dataset_type = MsgPortModeInfo.DATASET_TYPES.index(value_format["type"])
+        fmt = "<%d%s" % (value_format["datasets"], MsgPortModeInfo.DATASET_FORMATS[dataset_type])
+
+        raw_min, raw_max = descr.get("Raw range") or (0, 0)
+        si_min, si_max = descr.get("SI value range") or (raw_min, raw_max)
+        if raw_max == raw_min or (si_min == raw_min and si_max == raw_max):
+            return ValueDecoder(fmt)  # raw values are SI already
+        scale = float(si_max - si_min) / (raw_max - raw_min)
+        return ValueDecoder(fmt, scale, offset=si_min - raw_min * scale)
+
 
 class LEDRGB(Peripheral):
+    __slots__ = ()
+
     MODE_INDEX = 0x00
     MODE_RGB = 0x01
 
     def __init__(self, parent, port):
         super(LEDRGB, self).__init__(parent, port)
 
-    def set_color(self, color):
+    LAYOUT_INDEX = "BB"  # mode, color
+    LAYOUT_RGB = "BBBB"  # mode, red, green, blue
+
+    DECODERS = (
+        ValueDecoder("<B"),  # MODE_INDEX
+        ValueDecoder("<BBB"),  # MODE_RGB: red, green, blue
+    )
+
+    def set_color(self, color, wait=True):
+        mode, fmt, params = self._color_params(color)
+        self.set_port_mode(mode)
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, fmt, params)
+        return self._send_output(msg, wait)
+
+    def _color_params(self, color):
+        """
+        :return: mode, params format, params
+        """
         if isinstance(color, (list, tuple)):
             assert len(color) == 3, "RGB color has to have 3 values"
-            self.set_port_mode(self.MODE_RGB)
-            payload = pack("<B", self.MODE_RGB) + pack("<B", color[0]) + pack("<B", color[1]) + pack("<B", color[2])
-        else:
-            if color == COLOR_NONE:
-                color = COLOR_BLACK
-
-            if color not in COLORS:
-                raise ValueError("Color %s is not in list of available colors" % color)
+            return self.MODE_RGB, self.LAYOUT_RGB, (self.MODE_RGB, color[0], color[1], color[2])
 
-            self.set_port_mode(self.MODE_INDEX)
-            payload = pack("<B", self.MODE_INDEX) + pack("<B", color)
+        if color == COLOR_NONE:
+            color = COLOR_BLACK
 
-        msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        if color not in COLORS:
+            raise ValueError("Color %s is not in list of available colors" % color)
 
-    def _decode_port_data(self, msg):
-        if len(msg.payload) == 3:
-            return usbyte(msg.payload, 0), usbyte(msg.payload, 1), usbyte(msg.payload, 2),
-        else:
-            return usbyte(msg.payload, 0),
+        return self.MODE_INDEX, self.LAYOUT_INDEX, (self.MODE_INDEX, color)
 
 
 class Motor(Peripheral):
+    __slots__ = ()
+
     SUBCMD_START_POWER = 0x01
     SUBCMD_START_POWER_GROUPED = 0x02
     SUBCMD_SET_ACC_TIME = 0x05
@@ -278,99 +800,83 @@ class Motor(Peripheral):
         absolute = math.ceil(relative * 100)  # scale of 100 is proven by experiments
         return int(absolute)
 
-    def _write_direct_mode(self, subcmd, params):
-        params = pack("<B", subcmd) + params
-        msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, params)
-        self._send_output(msg)
+    # params formats of subcommands, for a single port and for a pair of virtual ports
+    LAYOUT_START_POWER = ("b", "bb")  # power
+    LAYOUT_ACC_PROFILE = ("HB", "HB")  # time, profile
+    LAYOUT_START_SPEED = ("bBB", "bbBB")  # speed, max power, use profile
+    LAYOUT_TIMED = ("HbBBB", "HbbBBB")  # time, speed, max power, end state, use profile
 
-    def _send_cmd(self, subcmd, params):
+    def _write_direct_mode(self, subcmd, fmt, params, wait=True):
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, "B" + fmt, (subcmd,) + params)
+        return self._send_output(msg, wait)
+
+    def _send_cmd(self, subcmd, layout, params, wait=True):
+        """
+        :param layout: pair of params formats, see LAYOUT_* constants
+        """
         if self.virtual_ports:
             subcmd += 1  # de-facto rule
 
-        msg = MsgPortOutput(self.port, subcmd, params)
-        self._send_output(msg)
+        msg = self._output_msg(subcmd, layout[1 if self.virtual_ports else 0], params)
+        return self._send_output(msg, wait)
 
-    def start_power(self, power_primary=1.0, power_secondary=None):
+    def _speeds(self, speed_primary, speed_secondary):
+        if speed_secondary is None:
+            speed_secondary = speed_primary
+
+        if self.virtual_ports:
+            return self._speed_abs(speed_primary), self._speed_abs(speed_secondary)
+        return self._speed_abs(speed_primary),
+
+    def start_power(self, power_primary=1.0, power_secondary=None, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startpower-power
         """
-        if power_secondary is None:
-            power_secondary = power_primary
-
         if self.virtual_ports:
             cmd = self.SUBCMD_START_POWER_GROUPED - 1  # because _send_cmd will do +1
         else:
             cmd = self.SUBCMD_START_POWER
 
-        params = b""
-        params += pack("<b", self._speed_abs(power_primary))
-        if self.virtual_ports:
-            params += pack("<b", self._speed_abs(power_secondary))
-
-        self._send_cmd(cmd, params)
+        params = self._speeds(power_primary, power_secondary)
+        return self._send_cmd(cmd, self.LAYOUT_START_POWER, params, wait)
 
-    def stop(self):
-        self.timed(0)
+    def stop(self, wait=True):
+        return self.timed(0, wait=wait)
 
-    def set_acc_profile(self, seconds, profile_no=0x00):
+    def set_acc_profile(self, seconds, profile_no=0x00, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-setacctime-time-profileno-0x05
         """
-        params = b""
-        params += pack("<H", int(seconds * 1000))
-        params += pack("<B", profile_no)
+        params = (int(seconds * 1000), profile_no)
+        return self._send_cmd(self.SUBCMD_SET_ACC_TIME, self.LAYOUT_ACC_PROFILE, params, wait)
 
-        self._send_cmd(self.SUBCMD_SET_ACC_TIME, params)
-
-    def set_dec_profile(self, seconds, profile_no=0x00):
+    def set_dec_profile(self, seconds, profile_no=0x00, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-setdectime-time-profileno-0x06
         """
-        params = b""
-        params += pack("<H", int(seconds * 1000))
-        params += pack("<B", profile_no)
-
-        self._send_cmd(self.SUBCMD_SET_DEC_TIME, params)
+        params = (int(seconds * 1000), profile_no)
+        return self._send_cmd(self.SUBCMD_SET_DEC_TIME, self.LAYOUT_ACC_PROFILE, params, wait)
 
-    def start_speed(self, speed_primary=1.0, speed_secondary=None, max_power=1.0, use_profile=0b11):
+    def start_speed(self, speed_primary=1.0, speed_secondary=None, max_power=1.0, use_profile=0b11, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeed-speed-maxpower-useprofile-0x07
         """
-        if speed_secondary is None:
-            speed_secondary = speed_primary
-
-        params = b""
-        params += pack("<b", self._speed_abs(speed_primary))
-        if self.virtual_ports:
-            params += pack("<b", self._speed_abs(speed_secondary))
-
-        params += pack("<B", int(100 * max_power))
-        params += pack("<B", use_profile)
-
-        self._send_cmd(self.SUBCMD_START_SPEED, params)
+        params = self._speeds(speed_primary, speed_secondary) + (int(100 * max_power), use_profile)
+        return self._send_cmd(self.SUBCMD_START_SPEED, self.LAYOUT_START_SPEED, params, wait)
 
     def timed(self, seconds, speed_primary=1.0, speed_secondary=None, max_power=1.0, end_state=END_STATE_BRAKE,
-              use_profile=0b11):
+              use_profile=0b11, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeedfortime-time-speed-maxpower-endstate-useprofile-0x09
         """
-        if speed_secondary is None:
-            speed_secondary = speed_primary
-
-        params = b""
-        params += pack("<H", int(seconds * 1000))
-        params += pack("<b", self._speed_abs(speed_primary))
-        if self.virtual_ports:
-            params += pack("<b", self._speed_abs(speed_secondary))
-
-        params += pack("<B", int(100 * max_power))
-        params += pack("<B", end_state)
-        params += pack("<B", use_profile)
-
-        self._send_cmd(self.SUBCMD_START_SPEED_FOR_TIME, params)
+        params = (int(seconds * 1000),) + self._speeds(speed_primary, speed_secondary) \
+                 + (int(100 * max_power), end_state, use_profile)
+        return self._send_cmd(self.SUBCMD_START_SPEED_FOR_TIME, self.LAYOUT_TIMED, params, wait)
 
 
 class EncodedMotor(Motor):
+    __slots__ = ()
+
     SUBCMD_START_SPEED_FOR_DEGREES = 0x0B
     # SUBCMD_START_SPEED_FOR_DEGREES = 0x0C
     SUBCMD_GOTO_ABSOLUTE_POSITION = 0x0D
@@ -382,8 +888,18 @@ class EncodedMotor(Motor):
     SENSOR_ANGLE = 0x02
     SENSOR_TEST = 0x03  # exists, but neither input nor output mode
 
+    LAYOUT_ANGLED = ("IbBBB", "IbbBBB")  # degrees, speed, max power, end state, use profile
+    LAYOUT_GOTO_POSITION = ("ibBBB", "iibBBB")  # position, speed, max power, end state, use profile
+    LAYOUT_PRESET_ENCODER = ("i", "ii")  # position
+
+    DECODERS = (
+        None,  # SENSOR_POWER
+        ValueDecoder("<b"),  # SENSOR_SPEED
+        ValueDecoder("<l"),  # SENSOR_ANGLE
+    )
+
     def angled(self, degrees, speed_primary=1.0, speed_secondary=None, max_power=1.0, end_state=Motor.END_STATE_BRAKE,
-               use_profile=0b11):
+               use_profile=0b11, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeedfordegrees-degrees-speed-maxpower-endstate-useprofile-0x0b
         :type degrees: int
@@ -398,55 +914,30 @@ class EncodedMotor(Motor):
             speed_primary = -speed_primary
             speed_secondary = -speed_secondary
 
-        params = b""
-        params += pack("<I", degrees)
-        params += pack("<b", self._speed_abs(speed_primary))
-        if self.virtual_ports:
-            params += pack("<b", self._speed_abs(speed_secondary))
-
-        params += pack("<B", int(100 * max_power))
-        params += pack("<B", end_state)
-        params += pack("<B", use_profile)
-
-        self._send_cmd(self.SUBCMD_START_SPEED_FOR_DEGREES, params)
+        params = (degrees,) + self._speeds(speed_primary, speed_secondary) + (int(100 * max_power), end_state,
+                                                                              use_profile)
+        return self._send_cmd(self.SUBCMD_START_SPEED_FOR_DEGREES, self.LAYOUT_ANGLED, params, wait)
 
     def goto_position(self, degrees_primary, degrees_secondary=None, speed=1.0, max_power=1.0,
-                      end_state=Motor.END_STATE_BRAKE, use_profile=0b11):
+                      end_state=Motor.END_STATE_BRAKE, use_profile=0b11, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-gotoabsoluteposition-abspos-speed-maxpower-endstate-useprofile-0x0d
         """
         if degrees_secondary is None:
             degrees_secondary = degrees_primary
 
-        params = b""
-        params += pack("<i", degrees_primary)
         if self.virtual_ports:
-            params += pack("<i", degrees_secondary)
-
-        params += pack("<b", self._speed_abs(speed))
-
-        params += pack("<B", int(100 * max_power))
-        params += pack("<B", end_state)
-        params += pack("<B", use_profile)
-
-        self._send_cmd(self.SUBCMD_GOTO_ABSOLUTE_POSITION, params)
-
-    def _decode_port_data(self, msg):
-        data = msg.payload
-        if self._port_mode.mode == self.SENSOR_ANGLE:
-            angle = unpack("<l", data[0:4])[0]
-            return (angle,)
-        elif self._port_mode.mode == self.SENSOR_SPEED:
-            speed = unpack("<b", data[0:1])[0]
-            return (speed,)
+            params = (degrees_primary, degrees_secondary)
         else:
-            log.debug("Got motor sensor data while in unexpected mode: %r", self._port_mode)
-            return ()
+            params = (degrees_primary,)
 
-    def subscribe(self, callback, mode=SENSOR_ANGLE, granularity=1):
-        super(EncodedMotor, self).subscribe(callback, mode, granularity)
+        params += (self._speed_abs(speed), int(100 * max_power), end_state, use_profile)
+        return self._send_cmd(self.SUBCMD_GOTO_ABSOLUTE_POSITION, self.LAYOUT_GOTO_POSITION, params, wait)
 
-    def preset_encoder(self, degrees=0, degrees_secondary=None, only_combined=False):
+    def subscribe(self, callback, mode=SENSOR_ANGLE, granularity=1, ops=()):
+        super(EncodedMotor, self).subscribe(callback, mode, granularity, ops)
+
+    def preset_encoder(self, degrees=0, degrees_secondary=None, only_combined=False, wait=True):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-presetencoder-position-n-a
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-presetencoder-leftposition-rightposition-0x14
@@ -455,13 +946,15 @@ class EncodedMotor(Motor):
             degrees_secondary = degrees
 
         if self.virtual_ports and not only_combined:
-            self._send_cmd(self.SUBCMD_PRESET_ENCODER, pack("<i", degrees) + pack("<i", degrees_secondary))
+            params = (degrees, degrees_secondary)
+            return self._send_cmd(self.SUBCMD_PRESET_ENCODER, self.LAYOUT_PRESET_ENCODER, params, wait)
         else:
-            params = pack("<i", degrees)
-            self._write_direct_mode(self.SENSOR_ANGLE, params)
+            return self._write_direct_mode(self.SENSOR_ANGLE, self.LAYOUT_PRESET_ENCODER[0], (degrees,), wait)
 
 
 class TiltSensor(Peripheral):
+    __slots__ = ()
+
     MODE_2AXIS_ANGLE = 0x00
     MODE_2AXIS_SIMPLE = 0x01
     MODE_3AXIS_SIMPLE = 0x02
@@ -501,49 +994,30 @@ class TiltSensor(Peripheral):
         TRI_FRONT: "FRONT",
     }
 
+    DECODERS = (
+        ValueDecoder("<bb"),  # MODE_2AXIS_ANGLE: roll, pitch
+        ValueDecoder("<B"),  # MODE_2AXIS_SIMPLE: DUO_STATES
+        ValueDecoder("<B"),  # MODE_3AXIS_SIMPLE: TRI_STATES
+        ValueDecoder("<I"),  # MODE_IMPACT_COUNT
+        ValueDecoder("<bbb"),  # MODE_3AXIS_ACCEL: roll, pitch, yaw (did I get the order right?)
+        ValueDecoder("<B"),  # MODE_ORIENT_CF
+        ValueDecoder("<B"),  # MODE_IMPACT_CF
+        ValueDecoder("<BBB"),  # MODE_CALIBRATION
+    )
+
     def __init__(self, parent, port):
         super(TiltSensor, self).__init__(parent, port)
 
-    def subscribe(self, callback, mode=MODE_3AXIS_SIMPLE, granularity=1):
-        super(TiltSensor, self).subscribe(callback, mode, granularity)
-
-    def _decode_port_data(self, msg):
-        data = msg.payload
-        if self._port_mode.mode == self.MODE_2AXIS_ANGLE:
-            roll = unpack('<b', data[0:1])[0]
-            pitch = unpack('<b', data[1:2])[0]
-            return (roll, pitch)
-        elif self._port_mode.mode == self.MODE_3AXIS_SIMPLE:
-            state = usbyte(data, 0)
-            return (state,)
-        elif self._port_mode.mode == self.MODE_2AXIS_SIMPLE:
-            state = usbyte(data, 0)
-            return (state,)
-        elif self._port_mode.mode == self.MODE_IMPACT_COUNT:
-            bump_count = usint(data, 0)
-            return (bump_count,)
-        elif self._port_mode.mode == self.MODE_3AXIS_ACCEL:
-            roll = unpack('<b', data[0:1])[0]
-            pitch = unpack('<b', data[1:2])[0]
-            yaw = unpack('<b', data[2:3])[0]  # did I get the order right?
-            return (roll, pitch, yaw)
-        elif self._port_mode.mode == self.MODE_ORIENT_CF:
-            state = usbyte(data, 0)
-            return (state,)
-        elif self._port_mode.mode == self.MODE_IMPACT_CF:
-            state = usbyte(data, 0)
-            return (state,)
-        elif self._port_mode.mode == self.MODE_CALIBRATION:
-            return (usbyte(data, 0), usbyte(data, 1), usbyte(data, 2))
-        else:
-            log.debug("Got tilt sensor data while in unexpected mode: %r", self._port_mode)
-            return ()
+    def subscribe(self, callback, mode=MODE_3AXIS_SIMPLE, granularity=1, ops=()):
+        super(TiltSensor, self).subscribe(callback, mode, granularity, ops)
 
     # TODO: add some methods from official doc, like
     # https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-tiltconfigimpact-impactthreshold-bumpholdoff-n-a
 
 
 class VisionSensor(Peripheral):
+    __slots__ = ()
+
     COLOR_INDEX = 0x00
     DISTANCE_INCHES = 0x01
     COUNT_2INCH = 0x02
@@ -557,105 +1031,90 @@ class VisionSensor(Peripheral):
     DEBUG = 0x09  # first val is by fact ambient light, second is zero
     CALIBRATE = 0x0a  # gives constant values
 
+    DECODERS = (
+        ValueDecoder("<B"),  # COLOR_INDEX
+        ValueDecoder("<B"),  # DISTANCE_INCHES
+        ValueDecoder("<I"),  # COUNT_2INCH
+        ValueDecoder("<B", 1 / 100.0),  # DISTANCE_REFLECTED
+        ValueDecoder("<B", 1 / 100.0),  # AMBIENT_LIGHT
+        None,  # SET_COLOR
+        ValueDecoder("<HHH", 255, 1023),  # COLOR_RGB, 0..255 per channel
+        None,  # SET_IR_TX
+        ColorDistanceDecoder("<BBxB"),  # COLOR_DISTANCE_FLOAT: color, distance, fraction of distance
+        ValueDecoder("<HH", 10 / 1023.0),  # DEBUG
+        ValueDecoder("<8H"),  # CALIBRATE
+    )
+
     def __init__(self, parent, port):
         super(VisionSensor, self).__init__(parent, port)
 
-    def subscribe(self, callback, mode=COLOR_DISTANCE_FLOAT, granularity=1): #COLOR_DISTANCE_FLOAT
-        super(VisionSensor, self).subscribe(callback, mode, granularity)
+    def subscribe(self, callback, mode=COLOR_DISTANCE_FLOAT, granularity=1, ops=()): #COLOR_DISTANCE_FLOAT
+        super(VisionSensor, self).subscribe(callback, mode, granularity, ops)
 
-    def _decode_port_data(self, msg):
-        data = msg.payload
-        if self._port_mode.mode == self.COLOR_INDEX:
-            color = usbyte(data, 0)
-            return (color,)
-        elif self._port_mode.mode == self.COLOR_DISTANCE_FLOAT:
-            color = usbyte(data, 0)
-            val = usbyte(data, 1)
-            partial = usbyte(data, 3)
-            if partial:
-                val += 1.0 / partial
-            return (color, float(val))
-        elif self._port_mode.mode == self.DISTANCE_INCHES:
-            val = usbyte(data, 0)
-            return (val,)
-        elif self._port_mode.mode == self.DISTANCE_REFLECTED:
-            val = usbyte(data, 0) / 100.0
-            return (val,)
-        elif self._port_mode.mode == self.AMBIENT_LIGHT:
-            val = usbyte(data, 0) / 100.0
-            return (val,)
-        elif self._port_mode.mode == self.COUNT_2INCH:
-            count = usint(data, 0)
-            return (count,)
-        elif self._port_mode.mode == self.COLOR_RGB:
-            val1 = int(255 * ushort(data, 0) / 1023.0)
-            val2 = int(255 * ushort(data, 2) / 1023.0)
-            val3 = int(255 * ushort(data, 4) / 1023.0)
-            return (val1, val2, val3)
-        elif self._port_mode.mode == self.DEBUG:
-            val1 = 10 * ushort(data, 0) / 1023.0
-            val2 = 10 * ushort(data, 2) / 1023.0
-            return (val1, val2)
-        elif self._port_mode.mode == self.CALIBRATE:
-            return [ushort(data, x * 2) for x in range(8)]
-        else:
-            log.debug("Unhandled VisionSensor data in mode %s: %s", self._port_mode.mode, str2hex(data))
-            return ()
+    LAYOUT_SET_COLOR = "BB"  # mode, color
+    LAYOUT_SET_IR_TX = "BH"  # mode, level
 
-    def set_color(self, color):
+    def set_color(self, color, wait=True):
+        params = self._color_params(color)
+        self.set_port_mode(self.SET_COLOR)
+
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, self.LAYOUT_SET_COLOR, params)
+        return self._send_output(msg, wait)
+
+    def _color_params(self, color):
         if color == COLOR_NONE:
             color = COLOR_BLACK
 
         if color not in COLORS:
             raise ValueError("Color %s is not in list of available colors" % color)
 
-        self.set_port_mode(self.SET_COLOR)
-        payload = pack("<B", self.SET_COLOR) + pack("<B", color)
+        return self.SET_COLOR, color
 
-        msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
-
-    def set_ir_tx(self, level=1.0):
-        assert 0 <= level <= 1.0
+    def set_ir_tx(self, level=1.0, wait=True):
+        params = self._ir_tx_params(level)
         self.set_port_mode(self.SET_IR_TX)
-        payload = pack("<B", self.SET_IR_TX) + pack("<H", int(level * 65535))
 
-        msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        msg = self._output_msg(MsgPortOutput.WRITE_DIRECT_MODE_DATA, self.LAYOUT_SET_IR_TX, params)
+        return self._send_output(msg, wait)
+
+    def _ir_tx_params(self, level):
+        assert 0 <= level <= 1.0
+        return self.SET_IR_TX, int(level * 65535)
 
 
 class Voltage(Peripheral):
+    __slots__ = ()
+
     # sensor says there are "L" and "S" values, but what are they?
     VOLTAGE_L = 0x00
     VOLTAGE_S = 0x01
 
+    _VOLTS = RatioDecoder("<H", 9600.0, (3893.0, 1000.0))
+    DECODERS = (_VOLTS, _VOLTS)
+
     def __init__(self, parent, port):
         super(Voltage, self).__init__(parent, port)
 
-    def _decode_port_data(self, msg):
-        data = msg.payload
-        val = ushort(data, 0)
-        volts = 9600.0 * val / 3893.0 / 1000.0
-        return (volts,)
-
 
 class Current(Peripheral):
+    __slots__ = ()
+
     CURRENT_L = 0x00
     CURRENT_S = 0x01
 
+    _MILLIAMPERS = RatioDecoder("<H", 2444, (4095.0,))
+    DECODERS = (_MILLIAMPERS, _MILLIAMPERS)
+
     def __init__(self, parent, port):
         super(Current, self).__init__(parent, port)
 
-    def _decode_port_data(self, msg):
-        val = ushort(msg.payload, 0)
-        milliampers = 2444 * val / 4095.0
-        return (milliampers,)
-
 
 class Button(Peripheral):
     """
     It's not really a peripheral, we use MSG_DEVICE_INFO commands to interact with it
     """
+    __slots__ = ()
+
 
     def __init__(self, parent):
         super(Button, self).__init__(parent, 0)  # fake port 0
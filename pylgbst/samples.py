@@ -0,0 +1,130 @@
+"""
+Constant-memory capture of port values, see Peripheral.record
+"""
+import math
+from array import array
+
+from pylgbst.utilities import ticks_diff, ticks_us
+
+
+class SampleRing(object):
+    """
+    Last `capacity` values of a port with the time they arrived, kept in preallocated arrays:
+    one with `width` items per value, typed after the mode's value format, and one of ticks_us timestamps.
+    Oldest values are overwritten when full.
+
+    Values that don't fit the arrays (other width after a mode change, None items, floats in an int array)
+    are not kept and are counted in `skipped`.
+    """
+    __slots__ = ('capacity', 'typecode', 'width', 'values', 'ticks', 'count', 'total', 'skipped', '_next')
+
+    def __init__(self, capacity=256, typecode=None):
+        """
+        :param typecode: array typecode of value items, None to tell it from the first value
+        """
+        self.capacity = capacity
+        self.typecode = typecode
+        self.width = None
+        self.values = None  # allocated on first value, once its width is known
+        self.ticks = array('L', [0] * capacity)
+        self.count = 0  # values held
+        self.total = 0  # values kept since start, cursor of since()
+        self.skipped = 0
+        self._next = 0
+
+    def __repr__(self):
+        return "%s(%s/%s, %r)" % (self.__class__.__name__, self.count, self.capacity, self.typecode)
+
+    def _allocate(self, value):
+        has_float = False
+        for item in value:
+            if not isinstance(item, int):
+                has_float = True
+        if self.typecode is None or has_float:
+            self.typecode = 'f' if has_float else 'i'
+        self.width = len(value)
+        self.values = array(self.typecode, [0] * (self.capacity * self.width))
+
+    def add(self, value):
+        """
+        :type value: tuple
+        """
+        if self.values is None:
+            self._allocate(value)
+        if len(value) != self.width:
+            self.skipped += 1
+            return
+
+        base = self._next * self.width
+        try:
+            for i in range(self.width):
+                self.values[base + i] = value[i]
+        except (TypeError, OverflowError):
+            self.skipped += 1
+            return
+
+        self.ticks[self._next] = ticks_us()
+        self._next = (self._next + 1) % self.capacity
+        self.total += 1
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.count = 0
+        self._next = 0
+
+    def _slot(self, index):
+        """
+        :param index: 0 for the oldest value held
+        """
+        return (self._next - self.count + index) % self.capacity
+
+    def _sample(self, slot):
+        base = slot * self.width
+        return self.ticks[slot], tuple(self.values[base:base + self.width])
+
+    def snapshot(self):
+        """
+        :return: list of (ticks_us, value) from oldest to newest
+        """
+        return [self._sample(self._slot(i)) for i in range(self.count)]
+
+    def since(self, cursor=0):
+        """
+        Values that came after the previous call, for reading the capture bit by bit
+
+        :param cursor: what previous call returned, 0 for all values held
+        :return: list of (ticks_us, value), new cursor. Values overwritten before being read are gone.
+        """
+        first = max(cursor, self.total - self.count)
+        start = self.count - (self.total - first)
+        return [self._sample(self._slot(i)) for i in range(start, self.count)], self.total
+
+    def stats(self, item=0):
+        """
+        :param item: index of value item to give min/max/mean of
+        :return: dict of count, min, max, mean, mean interval between values and its jitter (standard deviation),
+            intervals in microseconds. None for what can't be told from values held.
+        """
+        result = {"count": self.count, "min": None, "max": None, "mean": None, "interval": None, "jitter": None}
+        if not self.count:
+            return result
+
+        total = 0
+        low = high = None
+        for i in range(self.count):
+            val = self.values[self._slot(i) * self.width + item]
+            total += val
+            if low is None or val < low:
+                low = val
+            if high is None or val > high:
+                high = val
+        result.update({"min": low, "max": high, "mean": total / self.count})
+
+        if self.count > 1:
+            intervals = [ticks_diff(self.ticks[self._slot(i)], self.ticks[self._slot(i - 1)])
+                         for i in range(1, self.count)]
+            mean = sum(intervals) / len(intervals)
+            variance = sum((interval - mean) ** 2 for interval in intervals) / len(intervals)
+            result.update({"interval": mean, "jitter": math.sqrt(variance)})
+        return result
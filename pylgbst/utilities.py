@@ -2,10 +2,109 @@
 This module offers some utilities, in a way they are work in both Python 2 and 3
 """
 
+import time
 import ubinascii
 #import logging
 import usys
-from ustruct import unpack
+from ustruct import unpack_from
+
+try:
+    from threading import Event as _ThreadingEvent, RLock as _ThreadingRLock
+except ImportError:  # MicroPython has no threading, notifications come from BLE IRQ and scheduled callbacks
+    _ThreadingEvent = None
+    _ThreadingRLock = None
+
+
+class RLock(object):
+    """
+    Reentrant lock shared by the caller and the notification handler.
+
+    With threads it is threading.RLock, the handler's thread waits for the caller.
+    Without them, the handler interrupts the caller between any two bytecodes and can't wait for it,
+    so it passes its work to run_exclusive(): run right away when the lock is free,
+    otherwise queued and run by the holder as it releases the lock.
+    """
+
+    def __init__(self):
+        self._lock = _ThreadingRLock() if _ThreadingRLock else None
+        self._held = 0
+        self._deferred = []
+
+    def __enter__(self):
+        if self._lock:
+            self._lock.acquire()
+        else:
+            self._held += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._lock:
+            self._lock.release()
+            return False
+
+        self._held -= 1
+        while not self._held and self._deferred:
+            self._held += 1  # before pop, so what comes meanwhile queues up behind
+            try:
+                func, args = self._deferred.pop(0)
+                func(*args)
+            except Exception as e:  # it's not the failure of the section being left
+                usys.print_exception(e)
+            finally:
+                self._held -= 1
+        return False
+
+    def run_exclusive(self, func, *args):
+        """
+        Runs func out of any section holding the lock: as is with threads, as those sections lock themselves,
+        after the holder releases the lock without them
+        """
+        if self._lock:
+            func(*args)
+        elif self._held or self._deferred:
+            self._deferred.append((func, args))  # keeps order behind the ones queued before
+        else:
+            self._held += 1
+            try:
+                func(*args)
+            finally:
+                self.__exit__(None, None, None)
+
+try:
+    from threading import Condition as _Condition, Thread as _Thread
+except ImportError:
+    _Condition = None
+
+try:
+    from machine import Timer as _MachineTimer
+except ImportError:
+    _MachineTimer = None
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+try:
+    from machine import idle
+except ImportError:
+    idle = None
+
+try:
+    from time import ticks_ms, ticks_us, ticks_add, ticks_diff
+except ImportError:
+    def ticks_ms():
+        return int(time.time() * 1000)
+
+    def ticks_us():
+        return int(time.time() * 1000000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
 
 #log = logging.getLogger(__name__)
 
@@ -18,10 +117,9 @@ from ustruct import unpack
 
 
 def check_unpack(seq, index, pattern, size):
-    """Check that we got size bytes, if so, unpack using pattern"""
-    data = seq[index: index + size]
-    assert len(data) == size, "Unexpected data len %d, expected %d" % (len(data), size)
-    return unpack(pattern, data)[0]
+    """Check that we got size bytes, if so, unpack using pattern, in place without slicing seq"""
+    assert len(seq) >= index + size, "Unexpected data len %d, expected %d" % (max(len(seq) - index, 0), size)
+    return unpack_from(pattern, seq, index)[0]
 
 
 def usbyte(seq, index):
@@ -44,3 +142,101 @@ def str2hex(data):  # we need it for python 2+3 compatibility
         data = bytes(data)
     hexed = ubinascii.hexlify(data)
     return hexed
+
+
+class Event(object):
+    """
+    One-shot flag to block on until another context sets it.
+    Uses threading.Event where available, otherwise sleeps until the next interrupt,
+    which is where MicroPython delivers BLE notifications.
+    """
+
+    def __init__(self):
+        self._flag = False
+        self._event = _ThreadingEvent() if _ThreadingEvent else None
+
+    def set(self):
+        self._flag = True
+        if self._event:
+            self._event.set()
+
+    def clear(self):
+        self._flag = False
+        if self._event:
+            self._event.clear()
+
+    def is_set(self):
+        return self._flag
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait, None to wait forever
+        :return: False if timeout has expired before the flag got set
+        """
+        if self._event:
+            return self._event.wait(timeout)
+
+        deadline = None if timeout is None else ticks_add(ticks_ms(), int(timeout * 1000))
+        while not self._flag:
+            if deadline is not None and ticks_diff(deadline, ticks_ms()) <= 0:
+                return False
+            if idle:
+                idle()
+            else:
+                time.sleep(0.001)
+        return True
+
+
+class OneShotTimer(object):
+    """
+    Calls callback once, some milliseconds after start().
+    Runs it from a thread of its own where there is threading, kept for all the starts,
+    from a soft timer callback on MicroPython.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._timer = None
+        self._deadline = None  # ticks_ms to fire at, with threading
+        self._cond = _Condition() if _Condition else None
+        self._fire_ref = self._fire  # bound method allocated once
+
+    @staticmethod
+    def available():
+        return bool(_Condition or _MachineTimer)
+
+    def _fire(self, _=None):
+        self.callback()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._deadline is None or ticks_diff(self._deadline, ticks_ms()) > 0:
+                    if self._deadline is None:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait(ticks_diff(self._deadline, ticks_ms()) / 1000.0)
+                self._deadline = None
+            self.callback()  # out of the condition, callback may take locks start() is called under
+
+    def start(self, delay_ms):
+        if self._cond:
+            with self._cond:
+                self._deadline = ticks_add(ticks_ms(), delay_ms)
+                if self._timer is None:
+                    self._timer = _Thread(target=self._run)
+                    self._timer.daemon = True
+                    self._timer.start()
+                self._cond.notify()
+        elif _MachineTimer:
+            if self._timer is None:
+                self._timer = _MachineTimer(-1)  # virtual timer, callback is scheduled, not a hard IRQ
+            self._timer.init(mode=_MachineTimer.ONE_SHOT, period=delay_ms, callback=self._fire_ref)
+
+    def cancel(self):
+        if self._cond:
+            with self._cond:
+                self._deadline = None
+                self._cond.notify()
+        elif self._timer is not None:
+            self._timer.deinit()